@@ -0,0 +1,107 @@
+# Measures what LTTB downsampling (covid_downsample.py) saves when drawing long time series:
+# the time to render a chart and the size of what is sent to the browser, with and without it.
+# Matplotlib charts are saved as PNG and SVG the way the SIRD tab does, plotly charts as JSON.
+#     python benchmarks/downsample.py --points 188,1826,20000,100000
+import argparse
+import io
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.figure
+import plotly.express as px
+from covid_downsample import downsample, downsample_frame
+
+SERIES = ["Infected", "Deaths", "Recovered"]
+
+
+# Daily series that look like epidemic waves with noise, one per name
+def make_series(points, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2020-01-22", periods=points)
+    t = np.arange(points)
+    data = {"Date": dates}
+    for i, name in enumerate(SERIES):
+        waves = np.sin(t / (60 + 20 * i)) ** 2 * 10_000 / (i + 1)
+        data[name] = np.maximum(waves + rng.normal(0, 500, points).cumsum() * 0.05, 0)
+    return pd.DataFrame(data)
+
+# Draw the series with matplotlib and save it, returns the seconds and the bytes
+def render_matplotlib(df, fmt, use_downsampling):
+    start = time.perf_counter()
+    if use_downsampling:
+        lines = downsample(df["Date"], [df[name] for name in SERIES])
+    else:
+        lines = [(df["Date"].to_numpy(), df[name].to_numpy()) for name in SERIES]
+    fig = matplotlib.figure.Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    for name, line in zip(SERIES, lines):
+        ax.plot(*line, label=name)
+    ax.legend()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt, dpi=200, bbox_inches="tight")
+    return time.perf_counter() - start, len(buffer.getvalue())
+
+# Build the plotly figure and its JSON as sent to the browser, returns the seconds and the bytes
+def render_plotly(df, use_downsampling):
+    start = time.perf_counter()
+    if use_downsampling:
+        df_lines = downsample_frame(df, "Date", SERIES)
+    else:
+        df_lines = df.melt(id_vars="Date", value_vars=SERIES)
+    fig = px.line(df_lines, x="Date", y="value", color="variable")
+    payload = fig.to_json()
+    return time.perf_counter() - start, len(payload.encode())
+
+# Best time and the size of every renderer with and without downsampling
+def measure(points, repeat):
+    df = make_series(points)
+    renderers = {
+        "matplotlib png": lambda use: render_matplotlib(df, "png", use),
+        "matplotlib svg": lambda use: render_matplotlib(df, "svg", use),
+        "plotly json": lambda use: render_plotly(df, use),
+    }
+    results = []
+    for name, render in renderers.items():
+        for use in (False, True):
+            runs = [render(use) for _ in range(repeat)]
+            results.append({
+                "points": points,
+                "renderer": name,
+                "downsampled": use,
+                "seconds": min(seconds for seconds, _ in runs),
+                "bytes": runs[0][1],
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render time and payload size with and without LTTB downsampling")
+    parser.add_argument("--points", default="188,1826,20000,100000", help="comma separated lengths of the series")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    for points in [int(points) for points in args.points.split(",")]:
+        results += measure(points, args.repeat)
+
+    df = pd.DataFrame(results)
+    table = df.pivot_table(index=["points", "renderer"], columns="downsampled", values=["seconds", "bytes"])
+    table.columns = [f"{value} {'lttb' if downsampled else 'all points'}" for value, downsampled in table.columns]
+    formatters = {column: ("{:,.0f}" if column.startswith("bytes") else "{:.3f}").format for column in table.columns}
+    print(table.to_string(formatters=formatters))
+
+    if args.json:
+        df.to_json(args.json, orient="records", indent=2)
+
+
+if __name__ == "__main__":
+    main()
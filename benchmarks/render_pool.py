@@ -0,0 +1,51 @@
+# Checks that the process pool of covid_render.py keeps working when the dashboard runs
+# under Streamlit: the dashboard is rendered twice for different countries without a browser,
+# and the SIRD figures must have been rendered in the pool both times without it breaking.
+#
+# Run from the folder with cleaned_complete.csv and covid_database.db:
+#     python benchmarks/render_pool.py
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Code run in a fresh interpreter, Streamlit replaces __main__ with the script like streamlit run does.
+# streamlit run also puts the folder of the script first on sys.path, which the workers inherit, so it
+# is inserted there after importing the streamlit package (the repo's streamlit.py would shadow it before).
+CHECK_SCRIPT = """
+import json, sys
+from streamlit.testing.v1 import AppTest
+sys.path.insert(0, {repo_dir!r})
+app = AppTest.from_file({script!r}, default_timeout={timeout})
+app.run()
+country = app.sidebar.selectbox[1]
+executors = []
+import covid_render
+executors.append(covid_render._executor is not None)
+app.sidebar.selectbox[1].select(country.options[-1]).run()
+executors.append(covid_render._executor is not None)
+print(json.dumps({{**covid_render.pool_stats, "alive": executors}}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the SIRD render pool stays alive under Streamlit")
+    parser.add_argument("--timeout", type=int, default=300, help="seconds one render of the dashboard may take")
+    args = parser.parse_args()
+
+    code = CHECK_SCRIPT.format(repo_dir=REPO_DIR, script=os.path.join(REPO_DIR, "streamlit.py"), timeout=args.timeout)
+    # -P keeps the current folder off sys.path, run from the repo folder it would shadow the streamlit package
+    result = subprocess.run([sys.executable, "-P", "-c", code], capture_output=True, text=True, check=True)
+    stats = json.loads(result.stdout.strip().splitlines()[-1])
+    print(f"Renders in the pool: {stats['parallel_renders']}, broken pools: {stats['broken_pools']}, pool alive after each run: {stats['alive']}")
+
+    if stats["broken_pools"] or stats["parallel_renders"] < 2 or not all(stats["alive"]):
+        print("The render pool did not stay alive, the SIRD tab was rendered serially")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
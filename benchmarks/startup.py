@@ -0,0 +1,86 @@
+# Measures the cold start of the dashboard: the import time of every module in a
+# fresh interpreter and the time of the first full render of streamlit.py.
+#
+# Run from the folder with cleaned_complete.csv and covid_database.db:
+#     python benchmarks/startup.py
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ["covid_statistics", "covid_statistics_usa", "covid_sird_model"]
+
+# Code run in a fresh interpreter, prints the import time and which heavy modules got imported
+IMPORT_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {repo_dir!r})
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [name for name in ("pandas", "matplotlib", "plotly") if name in sys.modules]}}))
+"""
+
+# Code run in a fresh interpreter, renders the whole dashboard once without a browser
+RENDER_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+# Added after importing streamlit, the repo's own streamlit.py would shadow the package
+sys.path.append({repo_dir!r})
+app = AppTest.from_file({script!r}, default_timeout={timeout})
+app.run()
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "exceptions": len(app.exception), "messages": [exception.message for exception in app.exception]}}))
+"""
+
+
+# Run a script in a new Python process and return the JSON it prints last. -P keeps the current
+# folder off sys.path, run from the repo folder its streamlit.py would shadow the streamlit package.
+def run_fresh(code):
+    result = subprocess.run([sys.executable, "-P", "-c", code], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+# Best of a number of cold imports of a module
+def measure_import(module, repeat):
+    runs = [run_fresh(IMPORT_SCRIPT.format(repo_dir=REPO_DIR, module=module)) for _ in range(repeat)]
+    best = min(runs, key=lambda run: run["seconds"])
+    return {"module": module, "seconds": best["seconds"], "loaded": best["loaded"]}
+
+# Best of a number of cold first renders of the dashboard
+def measure_first_render(repeat, timeout):
+    script = os.path.join(REPO_DIR, "streamlit.py")
+    runs = [run_fresh(RENDER_SCRIPT.format(repo_dir=REPO_DIR, script=script, timeout=timeout)) for _ in range(repeat)]
+    return min(runs, key=lambda run: run["seconds"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import time and time to first render of the dashboard")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--skip-render", action="store_true", help="only measure the imports")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = {"imports": [measure_import(module, args.repeat) for module in MODULES]}
+    for item in results["imports"]:
+        print(f"import {item['module']:<22} {item['seconds'] * 1000:8.1f} ms   loaded: {', '.join(item['loaded']) or '-'}")
+
+    if not args.skip_render:
+        results["first_render"] = measure_first_render(args.repeat, args.timeout)
+        print(f"first render of streamlit.py   {results['first_render']['seconds'] * 1000:8.1f} ms   exceptions: {results['first_render']['exceptions']}")
+        for message in results["first_render"]["messages"]:
+            print(f"  {message}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+    # The time of a render that raised is not comparable
+    if not args.skip_render and results["first_render"]["exceptions"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
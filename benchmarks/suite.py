@@ -0,0 +1,185 @@
+# Measures the time and peak memory of the main functions of the dashboard on synthetic data
+# at several scales, and compares the results with a saved baseline.
+#
+# Every scale is generated by benchmarks/synthetic.py into a temporary folder and measured
+# in a fresh Python process that runs from that folder.
+#     python benchmarks/suite.py --scales 1,10 --save-baseline baseline.json
+#     python benchmarks/suite.py --scales 1,10 --baseline baseline.json
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+import synthetic
+
+
+# The measured functions as (name, function, reset). reset is called before every run,
+# it empties the caches so every run computes the result again.
+def get_benchmarks(country):
+    sys.path.insert(0, REPO_DIR)
+    import covid_cube
+    import covid_daywise
+    import covid_sird_model
+    import covid_statistics
+    import covid_statistics_usa
+    import data_wrangling
+
+    def reset_date_range_engine():
+        covid_daywise._engine = None
+
+    def reset_cube():
+        covid_cube._cube = None
+
+    return [
+        ("estimate_parameters", lambda: covid_sird_model.estimate_parameters(country), covid_sird_model.parameter_cache.clear),
+        ("get_smooth_function", lambda: covid_sird_model.get_smooth_function(country), covid_sird_model.parameter_cache.clear),
+        ("get_smooth_function_SIRD", lambda: covid_sird_model.get_smooth_function_SIRD(country), covid_sird_model.parameter_cache.clear),
+        ("plot_covid_spread_animation", covid_statistics.plot_covid_spread_animation, covid_statistics.figure_cache.clear),
+        ("get_top_x_data", lambda: covid_statistics_usa.get_top_x_data("Confirmed"), None),
+        ("plot_usa_choropleth", covid_statistics_usa.plot_usa_choropleth, None),
+        ("get_totals", lambda: covid_statistics.get_totals("2020-03-01", "2020-05-01"), reset_date_range_engine),
+        ("get_cube", covid_cube.get_cube, reset_cube),
+        ("data_wrangling_stream", lambda: data_wrangling.run_streaming("complete.csv", "streamed_complete.csv"), None),
+        # Rewrites cleaned_complete.csv, so it runs last
+        ("data_wrangling_full", data_wrangling.run_full, None),
+    ]
+
+# Run a function once with its output hidden and return the seconds it took
+def run_once(function, reset):
+    if reset is not None:
+        reset()
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        function()
+        return time.perf_counter() - start
+
+# Peak memory allocated while running a function once, in MB
+def measure_peak_memory(function, reset):
+    if reset is not None:
+        reset()
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+        return tracemalloc.get_traced_memory()[1] / 1024 ** 2
+    finally:
+        tracemalloc.stop()
+
+# Measure all functions in this process, run from the folder with the synthetic data.
+# The first run includes loading the data, the best of the later runs is the time of the function itself.
+def run_worker(repeat, country, only=None):
+    results = []
+    for name, function, reset in get_benchmarks(country):
+        if only and name not in only:
+            continue
+        first = run_once(function, reset)
+        runs = [run_once(function, reset) for _ in range(repeat)]
+        results.append({
+            "name": name,
+            "first_seconds": first,
+            "seconds": min(runs),
+            "peak_mb": measure_peak_memory(function, reset),
+        })
+    return results
+
+# Generate the data of one scale in a temporary folder and measure it in a fresh process
+def run_scale(scale, repeat, only=None, keep=False):
+    folder = tempfile.mkdtemp(prefix=f"covid_benchmark_{scale}x_")
+    try:
+        rows = synthetic.generate(folder, scale=scale)
+        command = [sys.executable, os.path.abspath(__file__), "--worker", "--repeat", str(repeat), "--country", synthetic.country_name(0)]
+        if only:
+            command += ["--only", ",".join(only)]
+        env = dict(os.environ, MPLBACKEND="Agg")
+        result = subprocess.run(command, cwd=folder, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Benchmark at scale {scale} failed:\n{result.stderr}")
+        results = json.loads(result.stdout.strip().splitlines()[-1])
+        for item in results:
+            item["scale"] = scale
+        return rows, results
+    finally:
+        if keep:
+            print(f"Data of scale {scale} kept in {folder}")
+        else:
+            shutil.rmtree(folder, ignore_errors=True)
+
+# Ratio of the time of every result to the baseline, None where the baseline has no result
+def compare_with_baseline(results, baseline):
+    saved = {(item["scale"], item["name"]): item for item in baseline["results"]}
+    ratios = {}
+    for item in results:
+        before = saved.get((item["scale"], item["name"]))
+        if before is not None and before["seconds"] > 0:
+            ratios[(item["scale"], item["name"])] = item["seconds"] / before["seconds"]
+    return ratios
+
+def print_results(results, ratios, tolerance):
+    print(f"{'scale':>5}  {'function':<28} {'first ms':>10} {'best ms':>10} {'peak MB':>9} {'vs baseline':>12}")
+    for item in results:
+        ratio = ratios.get((item["scale"], item["name"]))
+        compared = "" if ratio is None else f"{ratio:.2f}x" + (" SLOWER" if ratio > tolerance else "")
+        print(f"{item['scale']:>4}x  {item['name']:<28} {item['first_seconds'] * 1000:10.1f} {item['seconds'] * 1000:10.1f} {item['peak_mb']:9.1f} {compared:>12}")
+
+    # How the time of every function grows with the data, relative to the smallest scale
+    smallest = min(item["scale"] for item in results)
+    base = {item["name"]: item["seconds"] for item in results if item["scale"] == smallest}
+    growth = [item for item in results if item["scale"] != smallest and base.get(item["name"])]
+    if growth:
+        print(f"\nTime relative to scale {smallest}x:")
+        for item in growth:
+            print(f"{item['scale']:>4}x  {item['name']:<28} {item['seconds'] / base[item['name']]:8.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard functions on synthetic data at several scales")
+    parser.add_argument("--scales", default="1,10,100", help="comma separated scales, 1 is about the size of the real data")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", help="comma separated names of the functions to measure")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--save-baseline", help="write the results to this JSON file")
+    parser.add_argument("--tolerance", type=float, default=1.25, help="time ratio to the baseline that counts as slower")
+    parser.add_argument("--keep", action="store_true", help="keep the generated data folders")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--country", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    only = args.only.split(",") if args.only else None
+
+    if args.worker:
+        print(json.dumps(run_worker(args.repeat, args.country, only)))
+        return
+
+    rows = {}
+    results = []
+    for scale in [int(scale) for scale in args.scales.split(",")]:
+        rows[scale], scale_results = run_scale(scale, args.repeat, only, args.keep)
+        results += scale_results
+
+    ratios = {}
+    if args.baseline:
+        with open(args.baseline) as file:
+            ratios = compare_with_baseline(results, json.load(file))
+    print_results(results, ratios, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump({"rows": rows, "results": results}, file, indent=2)
+
+    # Exit with an error when a function got slower than the tolerance allows
+    if any(ratio > args.tolerance for ratio in ratios.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# Generates synthetic cleaned_complete.csv, complete.csv and covid_database.db files with the
+# same columns as the real data, to measure how the functions scale as the data grows.
+#
+# At scale 1 the sizes are close to the real data: 190 countries over 188 days and about
+# 3300 USA counties. Scale 10 and 100 have 10 and 100 times as many countries and counties.
+#     python benchmarks/synthetic.py --scale 10 --output /tmp/covid_10x
+import argparse
+import os
+import sqlite3
+import sys
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Sizes at scale 1
+COUNTRIES = 190
+DAYS = 188
+COUNTIES = 3300
+USA_DAYS = 14
+FIRST_DATE = "2020-01-22"
+
+CONTINENTS = ["Asia", "Europe", "Africa", "North America", "South America", "Australia/Oceania"]
+WHO_REGIONS = ["Eastern Mediterranean", "Europe", "Africa", "Americas", "Western Pacific", "South-East Asia"]
+
+# States of the USA, counties are spread over them
+STATES = [
+    "Alabama", "Alaska", "Arizona", "Arkansas", "California", "Colorado", "Connecticut", "Delaware",
+    "Florida", "Georgia", "Hawaii", "Idaho", "Illinois", "Indiana", "Iowa", "Kansas", "Kentucky",
+    "Louisiana", "Maine", "Maryland", "Massachusetts", "Michigan", "Minnesota", "Mississippi",
+    "Missouri", "Montana", "Nebraska", "Nevada", "New Hampshire", "New Jersey", "New Mexico",
+    "New York", "North Carolina", "North Dakota", "Ohio", "Oklahoma", "Oregon", "Pennsylvania",
+    "Rhode Island", "South Carolina", "South Dakota", "Tennessee", "Texas", "Utah", "Vermont",
+    "Virginia", "Washington", "West Virginia", "Wisconsin", "Wyoming", "Puerto Rico", "Guam",
+]
+
+
+# Name of the i-th synthetic country, the same at every scale
+def country_name(i):
+    return f"Country {i:06d}"
+
+# Cumulative cases, deaths and recoveries of an epidemic per entity and day, shape (entities, days).
+# Every entity gets a logistic curve with its own size, growth rate and start.
+def epidemic_curves(rng, entities, days, populations):
+    t = np.arange(days)
+    size = populations * rng.uniform(0.001, 0.02, entities)
+    growth = rng.uniform(0.05, 0.2, entities)
+    midpoint = rng.uniform(40, days, entities)
+    confirmed = np.floor(size[:, np.newaxis] / (1 + np.exp(-growth[:, np.newaxis] * (t - midpoint[:, np.newaxis]))))
+
+    # Deaths and recoveries follow the cases with a delay
+    death_rate = rng.uniform(0.005, 0.08, entities)[:, np.newaxis]
+    recovery_rate = rng.uniform(0.3, 0.9, entities)[:, np.newaxis]
+    lagged = np.concatenate([np.zeros((entities, 14)), confirmed[:, :-14]], axis=1)[:, :days]
+    deaths = np.floor(lagged * death_rate)
+    recovered = np.floor(lagged * recovery_rate)
+    return confirmed, deaths, recovered
+
+# Countries with their population, coordinates, continent and WHO region
+def generate_countries(rng, scale):
+    countries = COUNTRIES * scale
+    return pd.DataFrame({
+        "Country.Region": [country_name(i) for i in range(countries)],
+        "Population": np.floor(rng.lognormal(16, 1.5, countries)) + 10_000,
+        "Lat": rng.uniform(-60, 70, countries).round(4),
+        "Long": rng.uniform(-180, 180, countries).round(4),
+        "Continent": rng.choice(CONTINENTS, countries),
+        "WHO.Region": rng.choice(WHO_REGIONS, countries),
+    })
+
+# The panel of cleaned_complete.csv, one row per country and day
+def generate_panel(rng, df_countries, days=DAYS):
+    countries = len(df_countries)
+    confirmed, deaths, recovered = epidemic_curves(rng, countries, days, df_countries["Population"].to_numpy())
+    dates = pd.date_range(FIRST_DATE, periods=days).strftime("%Y-%m-%d")
+
+    # Rows ordered by date and then country, like the real file
+    df = pd.DataFrame({
+        "Province.State": None,
+        "Country.Region": np.tile(df_countries["Country.Region"].to_numpy(), days),
+        "Lat": np.tile(df_countries["Lat"].to_numpy(), days),
+        "Long": np.tile(df_countries["Long"].to_numpy(), days),
+        "Date": np.repeat(dates, countries),
+        "Confirmed": confirmed.T.ravel().astype(np.int64),
+        "Deaths": deaths.T.ravel().astype(np.int64),
+        "Recovered": recovered.T.ravel().astype(np.int64),
+        "WHO.Region": np.tile(df_countries["WHO.Region"].to_numpy(), days),
+    })
+    df["Active"] = df["Confirmed"] - df["Deaths"] - df["Recovered"]
+    return df[["Province.State", "Country.Region", "Lat", "Long", "Date", "Confirmed", "Deaths", "Recovered", "Active", "WHO.Region"]]
+
+# The last day of every country, as in worldometer_data
+def generate_worldometer(df_countries, df_panel):
+    last = df_panel.drop_duplicates("Country.Region", keep="last").set_index("Country.Region")
+    df = df_countries.set_index("Country.Region").join(last[["Confirmed", "Deaths", "Recovered", "Active"]])
+    return pd.DataFrame({
+        "Country.Region": df.index,
+        "Continent": df["Continent"].to_numpy(),
+        "Population": df["Population"].to_numpy(),
+        "TotalCases": df["Confirmed"].to_numpy(),
+        "TotalDeaths": df["Deaths"].to_numpy(),
+        "TotalRecovered": df["Recovered"].to_numpy(),
+        "ActiveCases": df["Active"].to_numpy(),
+        "Deaths.1M.pop": (df["Deaths"] / df["Population"] * 1_000_000).round(1).to_numpy(),
+        "WHO.Region": df["WHO.Region"].to_numpy(),
+    })
+
+# World totals per day, as in day_wise
+def generate_day_wise(df_panel):
+    df = df_panel.groupby("Date", as_index=False)[["Confirmed", "Deaths", "Recovered", "Active"]].sum()
+    df["New cases"] = df["Confirmed"].diff().fillna(0)
+    df["New deaths"] = df["Deaths"].diff().fillna(0)
+    df["New recovered"] = df["Recovered"].diff().fillna(0)
+    df["Deaths / 100 Cases"] = (df["Deaths"] / df["Confirmed"].where(df["Confirmed"] > 0) * 100).round(2).fillna(0)
+    df["Recovered / 100 Cases"] = (df["Recovered"] / df["Confirmed"].where(df["Confirmed"] > 0) * 100).round(2).fillna(0)
+    df["Deaths / 100 Recovered"] = (df["Deaths"] / df["Recovered"].where(df["Recovered"] > 0) * 100).round(2).fillna(0)
+    df["No. of countries"] = df_panel.loc[df_panel["Confirmed"] > 0].groupby("Date").size().reindex(df["Date"], fill_value=0).to_numpy()
+    return df
+
+# Counties of the USA over the last usa_days days, as in usa_county_wise
+def generate_usa_county_wise(rng, scale, usa_days=USA_DAYS):
+    counties = COUNTIES * scale
+    confirmed, deaths, _ = epidemic_curves(rng, counties, DAYS, np.floor(rng.lognormal(10.5, 1.2, counties)) + 500)
+    dates = pd.date_range(FIRST_DATE, periods=DAYS).strftime("%Y-%m-%d")[-usa_days:]
+    states = rng.choice(STATES, counties)
+    return pd.DataFrame({
+        "Province_State": np.tile(states, usa_days),
+        "Admin2": np.tile([f"County {i:07d}" for i in range(counties)], usa_days),
+        "Lat": np.tile(rng.uniform(25, 49, counties).round(4), usa_days),
+        "Long_": np.tile(rng.uniform(-124, -67, counties).round(4), usa_days),
+        "Date": np.repeat(dates, counties),
+        "Confirmed": confirmed[:, -usa_days:].T.ravel().astype(np.int64),
+        "Deaths": deaths[:, -usa_days:].T.ravel().astype(np.int64),
+        "Country_Region": "US",
+    })
+
+# Write all synthetic data files for one scale into a folder and return the number of rows per file
+def generate(output, scale=1, seed=0, migrate=True):
+    os.makedirs(output, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    df_countries = generate_countries(rng, scale)
+    df_panel = generate_panel(rng, df_countries)
+    df_panel.to_csv(os.path.join(output, "cleaned_complete.csv"), index=False)
+
+    # The raw feed, already clean so both pipelines of data_wrangling.py can run on it
+    df_panel.to_csv(os.path.join(output, "complete.csv"), index=False)
+
+    path = os.path.join(output, "covid_database.db")
+    if os.path.exists(path):
+        os.remove(path)
+    df_worldometer = generate_worldometer(df_countries, df_panel)
+    df_day_wise = generate_day_wise(df_panel)
+    df_usa = generate_usa_county_wise(rng, scale)
+    with sqlite3.connect(path) as connection:
+        df_worldometer.to_sql("worldometer_data", connection, index=False)
+        df_day_wise.to_sql("day_wise", connection, index=False)
+        df_usa.to_sql("usa_county_wise", connection, index=False)
+    connection.close()
+
+    # Indexes and snapshot tables of the USA tab, as on the real database
+    if migrate:
+        sys.path.insert(0, REPO_DIR)
+        import database_migrations
+        database_migrations.migrate(path)
+
+    return {
+        "cleaned_complete.csv": len(df_panel),
+        "worldometer_data": len(df_worldometer),
+        "day_wise": len(df_day_wise),
+        "usa_county_wise": len(df_usa),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic data files at a given scale")
+    parser.add_argument("--scale", type=int, default=1, help="multiplies the number of countries and counties")
+    parser.add_argument("--output", required=True, help="folder to write the files to")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-migrate", action="store_true", help="do not add the USA indexes and snapshot tables")
+    args = parser.parse_args()
+
+    rows = generate(args.output, scale=args.scale, seed=args.seed, migrate=not args.no_migrate)
+    for name, count in rows.items():
+        print(f"{name:<22} {count:>12,} rows")
+
+
+if __name__ == "__main__":
+    main()
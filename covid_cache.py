@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+import covid_trace
+
+_missing = object()
+
+
+# Bounded cache that drops the least recently used entry and counts hits and misses
+class LRUCache:
+    def __init__(self, maxsize=128, name="cache"):
+        self.maxsize = maxsize
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    # Return the cached value for key, or default when it is not cached
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, _missing)
+            if value is _missing:
+                self.misses += 1
+                if covid_trace.enabled:
+                    covid_trace.record("cache", self.name, hit=False, key=key)
+                return default
+            self.hits += 1
+            self._data.move_to_end(key)
+            if covid_trace.enabled:
+                covid_trace.record("cache", self.name, hit=True, key=key)
+            return value
+
+    # Store a value and evict the oldest entries above maxsize
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    # Return the cached value for key, computing and storing it on a miss
+    def get_or_compute(self, key, compute):
+        value = self.get(key, _missing)
+        if value is _missing:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    # Counters to check how well the cache works
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+            }
@@ -0,0 +1,196 @@
+import threading
+import numpy as np
+import pandas as pd
+from covid_db import read_sql, get_database_version
+from covid_panel import get_panel
+from covid_population import COUNTRY_ALIASES
+from covid_trace import traced
+
+# Counts that are summed over countries
+MEASURES = ["Confirmed", "Deaths", "Recovered", "Active"]
+
+# Levels of the cube from countries up to the world. The WHO region comes from cleaned_complete.csv,
+# the continent from worldometer_data, countries that are not in worldometer_data have no continent.
+LEVELS = ["country", "who_region", "continent", "global"]
+
+# Name of the only key of the global level
+GLOBAL = "World"
+
+_cube = None
+_cube_lock = threading.Lock()
+
+
+# Counts per country, region and date, built in one pass over the panel. Every level is an array of shape
+# (keys, dates, measures), so a region, a date or a date range is a slice of it. New days are appended
+# without going over the older days again. A cube shared by get_cube is never changed, new days are
+# appended to a copy.
+class AggregationCube:
+    def __init__(self, continents=None, version=None):
+        self.version = version
+        self.continents = continents or {}
+        self.dates = np.array([], dtype="datetime64[ns]")
+        self.keys = {level: [] for level in LEVELS}
+        self.positions = {level: {} for level in LEVELS}
+        self.values = {level: np.zeros((0, 0, len(MEASURES)), dtype=np.int64) for level in LEVELS}
+        # Index of the region of every country per level, -1 when a country has none
+        self.members = {level: [] for level in LEVELS[1:]}
+        # Rows of the panel that went into the cube
+        self.rows = 0
+
+    # Add the rows of a panel frame with dates after the last date of the cube
+    def append(self, df):
+        dates = df["Date"].to_numpy().astype("datetime64[ns]")
+        if len(self.dates) and len(dates) and dates.min() <= self.dates[-1]:
+            raise ValueError(f"Rows up to {self.dates[-1]} are already in the cube, only later dates can be appended")
+        if not len(dates):
+            return self
+
+        date_index, new_dates = pd.factorize(dates, sort=True)
+        new_dates = np.asarray(new_dates, dtype="datetime64[ns]")
+
+        # Countries get their WHO region from their first row
+        row_country, countries = pd.factorize(df["Country.Region"])
+        first_rows = np.unique(row_country, return_index=True)[1]
+        regions = df["WHO.Region"].iloc[first_rows]
+        country_index = np.array([self.add_country(str(country), region) for country, region in zip(countries, regions)])[row_country]
+
+        # Sum the rows (e.g. provinces) of every country and day, missing counts add nothing
+        cells = country_index * len(new_dates) + date_index
+        size = len(self.keys["country"]) * len(new_dates)
+        block = np.column_stack([
+            np.bincount(cells, weights=np.nan_to_num(df[measure].to_numpy(dtype=np.float64, na_value=np.nan)), minlength=size)
+            for measure in MEASURES
+        ])
+        block = block.round().astype(np.int64).reshape(len(self.keys["country"]), len(new_dates), len(MEASURES))
+
+        # Countries that are new in this block start with zeros on the older days
+        old = self.values["country"]
+        old = np.concatenate([old, np.zeros((len(block) - len(old), len(self.dates), len(MEASURES)), dtype=np.int64)])
+        self.values["country"] = np.concatenate([old, block], axis=1)
+
+        for level in LEVELS[1:]:
+            old = self.values[level]
+            old = np.concatenate([old, np.zeros((len(self.keys[level]) - len(old), len(self.dates), len(MEASURES)), dtype=np.int64)])
+            self.values[level] = np.concatenate([old, self.aggregate(level, block)], axis=1)
+
+        self.dates = np.concatenate([self.dates, new_dates])
+        self.rows += len(df)
+        return self
+
+    # Copy that new days can be appended to, the arrays are shared because append replaces them
+    def copy(self, version=None):
+        cube = AggregationCube(self.continents, version=version)
+        cube.dates = self.dates
+        cube.keys = {level: list(keys) for level, keys in self.keys.items()}
+        cube.positions = {level: dict(positions) for level, positions in self.positions.items()}
+        cube.values = dict(self.values)
+        cube.members = {level: list(members) for level, members in self.members.items()}
+        cube.rows = self.rows
+        return cube
+
+    # Position of a country, added with its regions when it is new
+    def add_country(self, country, region):
+        position = self.positions["country"].get(country)
+        if position is not None:
+            return position
+        position = self.add_key("country", country)
+        # worldometer_data names some countries differently, e.g. USA for US
+        continent = self.continents.get(COUNTRY_ALIASES.get(country, country))
+        regions = {"who_region": region, "continent": continent, "global": GLOBAL}
+        for level, key in regions.items():
+            missing = pd.isna(key) or str(key) == "0"
+            self.members[level].append(-1 if missing else self.add_key(level, str(key)))
+        return position
+
+    def add_key(self, level, key):
+        position = self.positions[level].get(key)
+        if position is None:
+            position = self.positions[level][key] = len(self.keys[level])
+            self.keys[level].append(key)
+        return position
+
+    # Sum a block of country values (countries, dates, measures) into the regions of a level
+    def aggregate(self, level, block):
+        # As a product with the membership matrix, the sums stay exact below 2^53
+        members = np.array(self.members[level], dtype=np.int64)
+        membership = np.zeros((len(self.keys[level]), len(members)))
+        membership[members[members >= 0], np.flatnonzero(members >= 0)] = 1
+        result = membership @ block.reshape(len(members), -1).astype(np.float64)
+        return result.round().astype(np.int64).reshape((len(self.keys[level]),) + block.shape[1:])
+
+    # Positions of the dates start <= Date <= end, found by binary search
+    def get_date_slice(self, start=None, end=None):
+        first = 0 if start is None else np.searchsorted(self.dates, np.datetime64(pd.Timestamp(start)), side="left")
+        stop = len(self.dates) if end is None else np.searchsorted(self.dates, np.datetime64(pd.Timestamp(end)), side="right")
+        return slice(first, max(stop, first))
+
+    # Counts of one key over a date range as a view, shape (dates, measures) or (dates,) for one measure
+    def get(self, level, key=GLOBAL, measure=None, start=None, end=None):
+        position = self.positions[level].get(key)
+        if position is None:
+            raise KeyError(f"{key!r} is not a key of level {level!r}")
+        values = self.values[level][position, self.get_date_slice(start, end)]
+        if measure is None:
+            return values
+        return values[:, MEASURES.index(measure)]
+
+    # Counts of every key of a level on one date, as a frame indexed by the keys
+    def get_day(self, level, date):
+        position = np.searchsorted(self.dates, np.datetime64(pd.Timestamp(date)))
+        if position == len(self.dates) or self.dates[position] != np.datetime64(pd.Timestamp(date)):
+            raise KeyError(f"{date} is not a date of the cube")
+        return pd.DataFrame(self.values[level][:, position], index=pd.Index(self.keys[level], name=level), columns=MEASURES)
+
+    # Time series of one key as a frame with the date and every measure
+    def get_frame(self, level, key=GLOBAL, start=None, end=None):
+        dates = self.dates[self.get_date_slice(start, end)]
+        df = pd.DataFrame(self.get(level, key, start=start, end=end), columns=MEASURES)
+        df.insert(0, "Date", dates)
+        return df
+
+
+# Continent of every country in worldometer_data
+def get_continents():
+    df = read_sql('SELECT "Country.Region" AS Country, Continent FROM worldometer_data WHERE Continent IS NOT NULL')
+    return dict(zip(df["Country"], df["Continent"]))
+
+# Build the cube of a panel frame in one pass
+@traced("data")
+def build_cube(df, continents=None, version=None):
+    return AggregationCube(continents, version=version).append(df)
+
+# A copy of the cube with the days of the panel after its last date added. Returns None when the
+# older rows changed as well (e.g. after a full run of data_wrangling.py), the cube is then built again.
+def update_cube(cube, df, version=None):
+    dates = df["Date"].to_numpy()
+    if not len(cube.dates):
+        return None
+    old = dates <= cube.dates[-1]
+    if old.sum() != cube.rows:
+        return None
+    last_day = df.loc[dates == cube.dates[-1], MEASURES].to_numpy(dtype=np.float64, na_value=np.nan)
+    if not np.array_equal(np.nan_to_num(last_day).sum(axis=0).astype(np.int64), cube.values["global"][0, -1]):
+        return None
+    return cube.copy(version=version).append(df.loc[~old])
+
+# Return the shared cube of the current panel. Days appended to cleaned_complete.csv are added to it,
+# it is built again when older rows or the continents of the database changed. Sessions run in
+# separate threads, one of them updates the cube and the new cube replaces the old one in one step.
+@traced("data")
+def get_cube():
+    global _cube
+    panel = get_panel()
+    version = (panel.version, get_database_version())
+    cube = _cube
+    if cube is not None and cube.version == version:
+        return cube
+
+    with _cube_lock:
+        cube = _cube
+        if cube is not None and cube.version == version:
+            return cube
+        updated = None
+        if cube is not None and cube.version[1] == version[1]:
+            updated = update_cube(cube, panel.df, version)
+        _cube = updated if updated is not None else build_cube(panel.df, get_continents(), version=version)
+        return _cube
@@ -0,0 +1,172 @@
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from covid_panel import PanelStore, csv_path, get_cache_dir, get_csv_version, read_cleaned_complete
+from covid_trace import traced
+
+# Bump when the layout of a published panel changes
+PLANE_FORMAT = 1
+
+# Older published versions that are kept, processes that have not swapped yet may still map them
+KEEP_VERSIONS = 2
+
+
+# Directory next to the CSV with the published versions of the sorted panel
+def get_plane_dir(path=csv_path):
+    return os.path.join(get_cache_dir(path), "plane")
+
+# The pointer to the current version, None when nothing has been published
+def read_pointer(plane_dir):
+    try:
+        with open(os.path.join(plane_dir, "current.json")) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+# Point all processes to a new version, replaced in one step so readers never see half a file
+def write_pointer(plane_dir, pointer):
+    temporary = os.path.join(plane_dir, f"current.json.{os.getpid()}")
+    with open(temporary, "w") as file:
+        json.dump(pointer, file)
+    os.replace(temporary, os.path.join(plane_dir, "current.json"))
+
+# SHA-1 of the CSV as recorded by its column cache, None when there is no cache for the current file
+def get_source_hash(path=csv_path):
+    try:
+        with open(os.path.join(get_cache_dir(path), "meta.json")) as file:
+            source = json.load(file)["source"]
+    except (OSError, ValueError, KeyError):
+        return None
+    stat = os.stat(path)
+    if source["size"] != stat.st_size or source["mtime_ns"] != stat.st_mtime_ns:
+        return None
+    return source["sha1"]
+
+# Write the panel sorted by country and date, one .npy file per column plus the offsets of every country.
+# The files are written to a temporary directory that is renamed at the end, so a version is complete or absent.
+def publish_panel(df, directory):
+    df = df.sort_values(["Country.Region", "Date"], kind="mergesort").reset_index(drop=True)
+    parent = os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    temporary = tempfile.mkdtemp(prefix=".publishing_", dir=parent)
+
+    try:
+        columns = []
+        for i, column in enumerate(df.columns):
+            values = df[column]
+            entry = {"name": column, "file": f"{i}.npy", "dtype": str(values.dtype)}
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                # Codes in the smallest integer type, pandas uses them without a copy
+                entry["kind"] = "category"
+                entry["categories"] = [str(category) for category in values.cat.categories]
+                array = values.array.codes
+            elif values.dtype.kind == "M":
+                entry["kind"] = "datetime"
+                array = values.to_numpy().view(np.int64)
+            elif isinstance(values.dtype, pd.api.extensions.ExtensionDtype) and values.dtype.kind in "iu":
+                entry["kind"] = "nullable"
+                entry["mask"] = f"{i}_mask.npy"
+                np.save(os.path.join(temporary, entry["mask"]), values.isna().to_numpy())
+                array = values.fillna(0).to_numpy(dtype=values.dtype.numpy_dtype)
+            else:
+                entry["kind"] = "numeric"
+                array = values.to_numpy()
+            np.save(os.path.join(temporary, entry["file"]), np.ascontiguousarray(array))
+            columns.append(entry)
+
+        # Where every run of the same country starts and stops
+        codes = df["Country.Region"].array.codes if isinstance(df["Country.Region"].dtype, pd.CategoricalDtype) else df["Country.Region"].to_numpy()
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else np.array([], dtype=np.int64)
+        stops = np.r_[starts[1:], len(codes)]
+        np.save(os.path.join(temporary, "offsets.npy"), np.column_stack([starts, stops]).astype(np.int64))
+        countries = [str(country) for country in df["Country.Region"].iloc[starts]]
+
+        meta = {"format": PLANE_FORMAT, "rows": len(df), "columns": columns, "countries": countries}
+        with open(os.path.join(temporary, "meta.json"), "w") as file:
+            json.dump(meta, file)
+        # mkdtemp makes the directory private, other users of the machine attach to it as well
+        os.chmod(temporary, 0o755)
+        os.rename(temporary, directory)
+    except OSError:
+        shutil.rmtree(temporary, ignore_errors=True)
+        # Another process published the same version first
+        if not os.path.exists(os.path.join(directory, "meta.json")):
+            raise
+
+# Memory map a published version as a panel store, every process shares the same pages
+def load_plane(directory, version=None):
+    with open(os.path.join(directory, "meta.json")) as file:
+        meta = json.load(file)
+    if meta.get("format") != PLANE_FORMAT:
+        raise ValueError(f"Published panel in {directory} has format {meta.get('format')}")
+
+    data = {}
+    for entry in meta["columns"]:
+        array = np.load(os.path.join(directory, entry["file"]), mmap_mode="r")
+        if entry["kind"] == "category":
+            data[entry["name"]] = pd.Categorical.from_codes(array, dtype=pd.CategoricalDtype(entry["categories"]))
+        elif entry["kind"] == "datetime":
+            data[entry["name"]] = array.view(entry["dtype"])
+        elif entry["kind"] == "nullable":
+            mask = np.load(os.path.join(directory, entry["mask"]), mmap_mode="r")
+            data[entry["name"]] = pd.arrays.IntegerArray(np.asarray(array), np.asarray(mask))
+        else:
+            data[entry["name"]] = array
+    df = pd.DataFrame(data, copy=False)
+
+    offsets_array = np.load(os.path.join(directory, "offsets.npy"))
+    offsets = {country: (int(start), int(stop)) for country, (start, stop) in zip(meta["countries"], offsets_array)}
+    return PanelStore.from_sorted(df, meta["countries"], offsets, version=version)
+
+# Remove published versions other than the current one and the newest KEEP_VERSIONS
+def remove_old_versions(plane_dir, current):
+    versions = [name for name in os.listdir(plane_dir) if os.path.isdir(os.path.join(plane_dir, name)) and name != current]
+    versions.sort(key=lambda name: os.path.getmtime(os.path.join(plane_dir, name)), reverse=True)
+    for name in versions[KEEP_VERSIONS:]:
+        # Processes that still map the files keep reading them until they swap
+        shutil.rmtree(os.path.join(plane_dir, name), ignore_errors=True)
+
+# Publish the current CSV when it has no published version yet. Returns the pointer to it
+# (None when the folder is read-only) and the frame that was read.
+def publish_current(path=csv_path):
+    version = get_csv_version(path)
+    plane_dir = get_plane_dir(path)
+    df = read_cleaned_complete(path)
+    source_hash = get_source_hash(path)
+    if source_hash is None:
+        return None, df
+
+    name = source_hash[:12]
+    try:
+        directory = os.path.join(plane_dir, name)
+        if not os.path.exists(os.path.join(directory, "meta.json")):
+            publish_panel(df, directory)
+        pointer = {"format": PLANE_FORMAT, "csv_version": list(version), "directory": name}
+        write_pointer(plane_dir, pointer)
+        remove_old_versions(plane_dir, name)
+    except OSError:
+        return None, df
+    return pointer, df
+
+# Attach to the published panel of the CSV without copying it. The first process that sees a new
+# version of the CSV publishes it, the others map the same files. When nothing can be written,
+# the panel is kept in the memory of this process as before.
+@traced("load")
+def attach_panel(path=csv_path):
+    version = get_csv_version(path)
+    pointer = read_pointer(get_plane_dir(path))
+    df = None
+    if pointer is None or pointer.get("format") != PLANE_FORMAT or tuple(pointer["csv_version"]) != version:
+        pointer, df = publish_current(path)
+
+    if pointer is not None:
+        try:
+            return load_plane(os.path.join(get_plane_dir(path), pointer["directory"]), version=version)
+        except (OSError, ValueError, KeyError):
+            pass  # Removed by a newer version in the meantime, load it here
+    if df is None:
+        df = read_cleaned_complete(path)
+    return PanelStore(df, version=version)
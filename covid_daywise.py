@@ -0,0 +1,54 @@
+import numpy as np
+from covid_db import read_sql, get_database_version
+
+# Columns of day_wise used by the global statistics
+COLUMNS = ["Active", "Deaths", "Recovered", "Confirmed"]
+
+_engine = None
+
+
+# Rows of day_wise between two dates, as zero-copy slices of the engine's arrays
+class DateRange:
+    def __init__(self, dates, columns):
+        self.dates = dates
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __getitem__(self, column):
+        if column == "Date":
+            return self.dates
+        return self.columns[column]
+
+    # Active, deaths, recovered and confirmed of the last date in the range, zeros for an empty range
+    def get_totals(self):
+        if not len(self.dates):
+            return 0, 0, 0, 0
+        return tuple(self.columns[column][-1] for column in COLUMNS)
+
+
+# day_wise held as arrays sorted by date, any date range is found with two binary searches.
+# Dates are compared as 'YYYY-MM-DD' strings, the same as BETWEEN in the SQL queries did.
+class DateRangeEngine:
+    def __init__(self, df, version=None):
+        df = df.sort_values("Date", kind="mergesort")
+        self.version = version
+        self.dates = df["Date"].astype(str).to_numpy(dtype=str)
+        self.columns = {column: df[column].to_numpy() for column in COLUMNS}
+
+    # Rows with start_date <= Date <= end_date
+    def query(self, start_date, end_date):
+        start = np.searchsorted(self.dates, str(start_date), side="left")
+        stop = max(np.searchsorted(self.dates, str(end_date), side="right"), start)
+        return DateRange(self.dates[start:stop], {column: values[start:stop] for column, values in self.columns.items()})
+
+
+# Return the shared engine, loading day_wise again when the database has changed
+def get_date_range_engine():
+    global _engine
+    version = get_database_version()
+    if _engine is None or _engine.version != version:
+        df = read_sql("SELECT Date, Active, Deaths, Recovered, Confirmed FROM day_wise")
+        _engine = DateRangeEngine(df, version=version)
+    return _engine
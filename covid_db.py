@@ -0,0 +1,93 @@
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+import pandas as pd
+import covid_trace
+
+db_path = "covid_database.db"
+
+# Settings of every read-only connection: no writes, memory mapped reads and a 64 MB page cache
+PRAGMAS = (
+    "PRAGMA query_only = ON",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -65536",
+)
+
+# Number of prepared statements sqlite3 keeps per connection, keyed by the statement text
+CACHED_STATEMENTS = 256
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_query_stats = {}
+
+
+# Version of the database file, connections are opened again when it changes
+def get_database_version(path=db_path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+# Read-only connection of the current thread, opened once and reused for every query
+def get_connection(path=db_path):
+    version = get_database_version(path)
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    entry = connections.get(path)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    if entry is not None:
+        entry[1].close()
+
+    uri = f"file:{quote(os.path.abspath(path))}?mode=ro"
+    connection = sqlite3.connect(uri, uri=True, cached_statements=CACHED_STATEMENTS)
+    for pragma in PRAGMAS:
+        connection.execute(pragma)
+    connections[path] = (version, connection)
+    return connection
+
+# Close the connections of the current thread
+def close_connections():
+    for _, connection in getattr(_local, "connections", {}).values():
+        connection.close()
+    _local.connections = {}
+
+# Add the latency and row count of one query to the statistics
+def record_query(query, rows, seconds):
+    query = " ".join(query.split())
+    with _stats_lock:
+        stats = _query_stats.setdefault(query, {"calls": 0, "rows": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        stats["calls"] += 1
+        stats["rows"] += rows
+        stats["total_seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+    if covid_trace.enabled:
+        covid_trace.record("sql", query, seconds, rows=rows)
+
+# Latency per query text, slowest in total first
+def get_query_stats():
+    with _stats_lock:
+        rows = [{"query": query, **stats} for query, stats in _query_stats.items()]
+    df = pd.DataFrame(rows, columns=["query", "calls", "rows", "total_seconds", "max_seconds"])
+    df["mean_seconds"] = df["total_seconds"] / df["calls"]
+    return df.sort_values("total_seconds", ascending=False).reset_index(drop=True)
+
+def reset_query_stats():
+    with _stats_lock:
+        _query_stats.clear()
+
+# Run a query on the shared read-only connection and return a DataFrame
+def read_sql(query, params=None, path=db_path):
+    start = time.perf_counter()
+    df = pd.read_sql(query, get_connection(path), params=params)
+    record_query(query, len(df), time.perf_counter() - start)
+    return df
+
+# Run a query on the shared read-only connection and return all rows as tuples
+def fetch_all(query, params=(), path=db_path):
+    start = time.perf_counter()
+    rows = get_connection(path).execute(query, params).fetchall()
+    record_query(query, len(rows), time.perf_counter() - start)
+    return rows
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+# Points kept of every line, about the width of a chart on the dashboard in pixels
+POINT_BUDGET = 1000
+
+# Lines with more points than this are downsampled, shorter lines are drawn as they are
+AUTO_THRESHOLD = 2 * POINT_BUDGET
+
+
+# Positions on the x axis as floats, dates as nanoseconds
+def as_float_positions(x):
+    x = np.asarray(x)
+    if x.dtype.kind == "M":
+        return x.astype("datetime64[ns]").astype(np.int64).astype(np.float64)
+    if x.dtype.kind in "biuf":
+        return x.astype(np.float64)
+    # Strings such as 'YYYY-MM-DD' are evenly spaced categories
+    return np.arange(len(x), dtype=np.float64)
+
+# Largest-Triangle-Three-Buckets: the indices of the threshold points to keep of every series.
+# ys has shape (series, points) and shares x. The first and last points are always kept, and from
+# every bucket in between the point that makes the largest triangle with the point kept before it
+# and the mean of the next bucket. All series are handled at once, missing values are never picked
+# over a number. Returns an array of shape (series, threshold).
+def lttb_indices(x, ys, threshold):
+    x = as_float_positions(x)
+    ys = np.atleast_2d(np.asarray(ys, dtype=np.float64))
+    series, points = ys.shape
+    if threshold >= points or threshold < 3:
+        return np.broadcast_to(np.arange(points), (series, points)).copy()
+
+    # Bucket b holds the points edges[b] up to edges[b + 1], without the first and last point
+    edges = (np.arange(threshold - 1) * (points - 2) // (threshold - 2) + 1).astype(np.int64)
+    starts, stops = edges[:-1], edges[1:]
+
+    # Mean of every bucket from cumulative sums, ignoring missing values
+    finite = np.isfinite(ys)
+    y_sums = np.concatenate([np.zeros((series, 1)), np.cumsum(np.where(finite, ys, 0.0), axis=1)], axis=1)
+    counts = np.concatenate([np.zeros((series, 1)), np.cumsum(finite, axis=1)], axis=1)
+    x_sums = np.concatenate([[0.0], np.cumsum(x)])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_y = (y_sums[:, stops] - y_sums[:, starts]) / (counts[:, stops] - counts[:, starts])
+    mean_x = (x_sums[stops] - x_sums[starts]) / (stops - starts)
+
+    # The point after bucket b is the mean of bucket b + 1, and the last point for the last bucket
+    next_y = np.concatenate([mean_y[:, 1:], ys[:, -1:]], axis=1)
+    next_x = np.concatenate([mean_x[1:], x[-1:]])
+
+    rows = np.arange(series)
+    kept = np.empty((series, threshold), dtype=np.int64)
+    kept[:, 0] = 0
+    kept[:, -1] = points - 1
+    previous = np.zeros(series, dtype=np.int64)
+    for bucket in range(threshold - 2):
+        candidates = np.arange(starts[bucket], stops[bucket])
+        previous_x = x[previous][:, np.newaxis]
+        previous_y = ys[rows, previous][:, np.newaxis]
+        area = np.abs(
+            (previous_x - next_x[bucket]) * (ys[:, candidates] - previous_y)
+            - (previous_x - x[candidates]) * (next_y[:, bucket:bucket + 1] - previous_y)
+        )
+        area = np.where(np.isfinite(area), area, -1.0)
+        previous = candidates[np.argmax(area, axis=1)]
+        kept[:, bucket + 1] = previous
+    return kept
+
+# The points to draw of every line as (x, y) pairs: all points of short lines, and POINT_BUDGET
+# points picked by LTTB of lines longer than threshold
+def downsample(x, ys, max_points=POINT_BUDGET, threshold=AUTO_THRESHOLD):
+    x = x.to_numpy() if isinstance(x, (pd.Series, pd.Index)) else np.asarray(x)
+    ys = [y.to_numpy(dtype=np.float64, na_value=np.nan) if isinstance(y, pd.Series) else np.asarray(y) for y in ys]
+    if len(x) <= threshold:
+        return [(x, y) for y in ys]
+    kept = lttb_indices(x, np.vstack(ys), max_points)
+    return [(x[indices], y[indices]) for indices, y in zip(kept, ys)]
+
+# Long-format frame of downsampled lines for plotly: the x column, the value and the name of every line
+def downsample_frame(df, x, columns, max_points=POINT_BUDGET, threshold=AUTO_THRESHOLD):
+    lines = downsample(df[x], [df[column] for column in columns], max_points=max_points, threshold=threshold)
+    frames = [pd.DataFrame({x: line_x, "value": line_y, "variable": column}) for column, (line_x, line_y) in zip(columns, lines)]
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,187 @@
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from covid_panel import get_panel
+from covid_population import get_population_resolver
+from covid_simulation import simulate_sird
+
+# Fits of the last run
+fits_path = "sird_fits.json"
+
+# Names of the fitted parameters, in the order of the parameter vector
+PARAMETERS = ["beta", "gamma", "mu", "alpha"]
+
+# Starting point when there is no earlier fit, gamma as the 1/4.5 days used in estimate_parameters
+DEFAULT_PARAMETERS = {"beta": 0.2, "gamma": 1 / 4.5, "mu": 0.01, "alpha": 0.001}
+
+# Bounds of the daily rates while fitting
+LOWER_BOUND = 1e-8
+UPPER_BOUND = 2.0
+
+# Reported compartments that are compared with the simulation
+OBSERVED_COLUMNS = ["Active", "Recovered", "Deaths"]
+
+
+# Scaled differences between the simulated and reported I, R and D of many windows and parameter sets at once.
+# observed has shape (windows, days, 3) and log_parameters (windows, sets, 4),
+# the result has shape (windows, sets, 3 * days).
+def window_residuals(log_parameters, observed, N):
+    windows, sets, _ = log_parameters.shape
+    beta, gamma, mu, alpha = np.exp(log_parameters.reshape(-1, len(PARAMETERS))).T
+    I0, R0, D0 = np.repeat(observed[:, 0], sets, axis=0).T
+    with np.errstate(over="ignore", invalid="ignore"):
+        _, I, R, D = simulate_sird(N - I0 - R0 - D0, I0, R0, D0, beta, gamma, mu, alpha, days=observed.shape[1] - 1, N=N)
+
+    # Scale every compartment by its size in the window, so deaths count as much as active cases
+    scale = np.abs(observed).max(axis=1, keepdims=True) + 1.0
+    simulated = np.stack([I, R, D], axis=-1).reshape(observed.shape[1], windows, sets, 3).transpose(1, 2, 0, 3)
+    residuals = (simulated - observed[:, np.newaxis]) / scale[:, np.newaxis]
+    return residuals.reshape(windows, sets, -1)
+
+# Least squares fit of constant parameters in every window with Levenberg-Marquardt.
+# All windows are solved together: every iteration simulates the base points and the
+# forward differences of all windows in one ensemble, and one trial step per window.
+# The parameters are fitted as logarithms so they stay positive.
+# start_parameters has shape (windows, 4), returns the fitted parameters and the RMSE per window.
+def fit_windows(observed, N, start_parameters, max_iterations=100, step=1e-4, tolerance=1e-10):
+    windows, parameters = start_parameters.shape
+    bounds = np.log([LOWER_BOUND, UPPER_BOUND])
+    theta = np.clip(np.log(np.maximum(start_parameters, LOWER_BOUND)), *bounds)
+    residuals = window_residuals(theta[:, np.newaxis], observed, N)[:, 0]
+    cost = np.einsum("wm,wm->w", residuals, residuals)
+    damping = np.full(windows, 1e-3)
+    active = np.ones(windows, dtype=bool)
+    shifts = np.vstack([np.zeros(parameters), np.eye(parameters) * step])
+
+    for _ in range(max_iterations):
+        if not active.any():
+            break
+        # Base point and the four shifted points of every active window in one simulation
+        rows = np.flatnonzero(active)
+        all_residuals = window_residuals(theta[rows, np.newaxis] + shifts, observed[rows], N)
+        jacobian = (all_residuals[:, 1:] - all_residuals[:, :1]).transpose(0, 2, 1) / step
+        gradient = np.einsum("wmp,wm->wp", jacobian, residuals[rows])
+        hessian = np.einsum("wmp,wmq->wpq", jacobian, jacobian)
+
+        diagonal = np.einsum("wpp->wp", hessian) + 1e-12
+        system = hessian + damping[rows, np.newaxis, np.newaxis] * (diagonal[:, :, np.newaxis] * np.eye(parameters))
+        delta = np.linalg.solve(system, -gradient[:, :, np.newaxis])[:, :, 0]
+        trial = np.clip(theta[rows] + delta, *bounds)
+        trial_residuals = window_residuals(trial[:, np.newaxis], observed[rows], N)[:, 0]
+        with np.errstate(over="ignore", invalid="ignore"):
+            trial_cost = np.einsum("wm,wm->w", trial_residuals, trial_residuals)
+
+        # Take the step where it lowers the error, otherwise damp more and try again
+        better = np.isfinite(trial_cost) & (trial_cost < cost[rows])
+        accepted = rows[better]
+        converged = accepted[cost[accepted] - trial_cost[better] <= tolerance * np.maximum(cost[accepted], 1e-30)]
+        theta[accepted] = trial[better]
+        residuals[accepted] = trial_residuals[better]
+        cost[accepted] = trial_cost[better]
+        damping[accepted] = np.maximum(damping[accepted] / 3, 1e-12)
+        damping[rows[~better]] *= 3
+        active[converged] = False
+        active[damping > 1e10] = False
+
+    return np.exp(theta), np.sqrt(cost / residuals.shape[1])
+
+# Parameters to start every window from: the earlier fit of the same window when there is one,
+# otherwise the earlier fit of the closest window before it, otherwise DEFAULT_PARAMETERS
+def get_start_parameters(starts, previous_fits=None):
+    starts = pd.DatetimeIndex(starts)
+    defaults = pd.DataFrame([DEFAULT_PARAMETERS] * len(starts), index=starts)[PARAMETERS]
+    if previous_fits is None or previous_fits.empty:
+        return defaults.to_numpy(dtype=np.float64)
+    previous = previous_fits.assign(Start=pd.to_datetime(previous_fits["Start"]))
+    previous = previous.drop_duplicates("Start", keep="last").set_index("Start")[PARAMETERS].sort_index()
+    return previous.reindex(starts, method="ffill").fillna(defaults).to_numpy(dtype=np.float64)
+
+# Fit piecewise constant parameters for one country over sliding windows of window days,
+# starting every step days. previous_fits are earlier fits of the country to warm start from.
+def fit_country(country, window=14, step=7, previous_fits=None):
+    panel = get_panel()
+    rows = panel.get_slice(country)
+    N = get_population_resolver().lookup(country)
+    if rows is None or N is None or rows.stop - rows.start < 2:
+        return []
+
+    observed = np.column_stack([panel.columns[column][rows].astype(np.float64) for column in OBSERVED_COLUMNS])
+    dates = panel.columns["Date"][rows]
+    window = min(window, len(observed))
+    starts = np.arange(0, len(observed) - window + 1, step)
+    observed_windows = np.lib.stride_tricks.sliding_window_view(observed, window, axis=0)[starts].transpose(0, 2, 1)
+
+    start_parameters = get_start_parameters(dates[starts], previous_fits)
+    fitted, rmse = fit_windows(np.ascontiguousarray(observed_windows), float(N), start_parameters)
+
+    results = []
+    for i, start in enumerate(starts):
+        results.append({
+            "Country.Region": country,
+            "Start": dates[start],
+            "End": dates[start + window - 1],
+            **dict(zip(PARAMETERS, fitted[i])),
+            "rmse": rmse[i],
+        })
+    return results
+
+# Fit one country and time it, runs in the worker processes
+def fit_country_job(country, window, step, previous_fits):
+    start = time.perf_counter()
+    results = fit_country(country, window=window, step=step, previous_fits=previous_fits)
+    return country, results, time.perf_counter() - start
+
+# Fit all countries in a process pool. Returns the fits per window and the time per country.
+# Pass the fits of the previous run as previous_fits to start every window from its last fit.
+def fit_all_countries(countries=None, window=14, step=7, processes=None, previous_fits=None):
+    if countries is None:
+        countries = get_panel().countries
+    if previous_fits is None:
+        previous_fits = pd.DataFrame(columns=["Country.Region", "Start"] + PARAMETERS)
+    previous_by_country = dict(tuple(previous_fits.groupby("Country.Region")))
+    processes = processes or os.cpu_count() or 1
+
+    if processes == 1:
+        results = [fit_country_job(country, window, step, previous_by_country.get(country)) for country in countries]
+    else:
+        with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(fit_country_job, country, window, step, previous_by_country.get(country)) for country in countries]
+            results = [future.result() for future in futures]
+
+    df_fits = pd.DataFrame([row for _, rows, _ in results for row in rows],
+                           columns=["Country.Region", "Start", "End"] + PARAMETERS + ["rmse"])
+    df_timings = pd.DataFrame([(country, len(rows), seconds) for country, rows, seconds in results],
+                              columns=["Country.Region", "Windows", "Seconds"])
+    return df_fits, df_timings
+
+# Save the fits as JSON records, the next run loads them to warm start
+def save_fits(df_fits, path=fits_path):
+    df_fits.to_json(path, orient="records", date_format="iso")
+
+# Fits saved by an earlier run, None when there are none
+def load_fits(path=fits_path):
+    if not os.path.exists(path):
+        return None
+    return pd.read_json(path, orient="records", convert_dates=["Start", "End"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit the SIRD parameters of all countries over sliding windows.")
+    parser.add_argument("--window", type=int, default=14, help="days per window")
+    parser.add_argument("--step", type=int, default=7, help="days between the starts of two windows")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes, 1 fits in this process")
+    parser.add_argument("--output", default=fits_path, help="JSON file of the fits, also read to warm start")
+    parser.add_argument("--cold", action="store_true", help="ignore the fits of the previous run")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    previous_fits = None if args.cold else load_fits(args.output)
+    df_fits, df_timings = fit_all_countries(window=args.window, step=args.step, processes=args.processes, previous_fits=previous_fits)
+    save_fits(df_fits, args.output)
+
+    print(df_timings.sort_values("Seconds", ascending=False).head(10).to_string(index=False))
+    print(f"Fitted {len(df_timings)} countries ({len(df_fits)} windows) in {time.perf_counter() - start:.1f}s")
@@ -2,6 +2,8 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import datetime as dt
+from functools import lru_cache
+from covid_simulation import simulate_sird
 
 def create_figure(df):
     plt.figure(figsize=(12, 10))
@@ -54,10 +56,6 @@ def create_figure_sir(S, I, R, D):
 
 def load_sir():
     df = get_data_frame_sir()
-    S = []
-    I = []
-    R = []
-    D = []
 
     # Parameters
     beta = 0.3  # infection rate
@@ -70,46 +68,87 @@ def load_sir():
     D0 = df['Deaths'].iloc[0]   # initial deceased population
     N = S0 + I0 + R0 + D0  # total population
 
-    # Saving first entries to list
-    S.append(S0)
-    I.append(I0)
-    R.append(R0)
-    D.append(D0)
-
-    # Solving equations
-    i = 0
-    for index in df.iterrows():
-        delta_S = alpha*R[i] - beta*S[i]*I[i]/N
-        S.append(S[i] + delta_S)
-        delta_I = beta*S[i]*I[i]/N - mu*I[i] - gamma*I[i]
-        I.append(I[i] + delta_I)
-        delta_R = gamma*I[i] - alpha*R[i]
-        R.append(R[i] + delta_R)
-        delta_D = mu*I[i]
-        D.append(D[i] + delta_D)
-        i += 1
-
-    create_figure_sir(S,I,R,D)
+    # Solving equations, one step per row of the data (see covid_simulation.py)
+    S, I, R, D = simulate_sird(S0, I0, R0, D0, beta, gamma, mu, alpha, days=len(df), N=N)
+
+    create_figure_sir(S[:, 0], I[:, 0], R[:, 0], D[:, 0])
+
+# Susceptible population used when no population is given, the same as S0 in load_sir
+DEFAULT_SUSCEPTIBLE = 17000000
+
+# Load the global day_wise series once, every estimate reuses it
+@lru_cache(maxsize=1)
+def load_day_wise(path='day_wise.csv'):
+    df = pd.read_csv(path)
+    return df[['Date', 'Deaths', 'Recovered', 'Active']].copy()
+
+# Estimate beta, gamma, mu and R0 for every day in one pass.
+# I is the reported active cases and S the population minus the reported active,
+# recovered and deaths. N is S0 + I0 + R0 + D0 of the first day when it is not given, like in load_sir.
+# Day 0 and day 1 have no estimate and are 0, like update_parameters always did.
+def estimate_time_varying_parameters(df=None, N=None):
+    if df is None:
+        df = load_day_wise()
+    active = df['Active'].to_numpy()
+    recovered = df['Recovered'].to_numpy()
+    deaths = df['Deaths'].to_numpy()
+    if N is None:
+        N = DEFAULT_SUSCEPTIBLE + active[0] + recovered[0] + deaths[0]
+
+    I = active
+    S = N - active - recovered - deaths
+
+    # Values of the previous day, for every day from day 2 on
+    days = len(df)
+    beta = np.zeros(days)
+    gamma = np.zeros(days)
+    mu = np.zeros(days)
+    if days > 2:
+        I_prev = I[1:-1]
+        S_prev = S[1:-1]
+        new_recoveries = recovered[2:] - recovered[1:-1]
+        new_deaths = deaths[2:] - deaths[1:-1]
+        new_active = active[2:] - active[1:-1]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            has_infected = I_prev > 0
+            gamma[2:] = np.where(has_infected, new_recoveries / I_prev, 0)
+            mu[2:] = np.where(has_infected, new_deaths / I_prev, 0)
+            beta[2:] = np.where(S_prev * I_prev > 0, (new_active + mu[2:] * I_prev + gamma[2:] * I_prev) / (S_prev * I_prev / N), 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        R0 = np.where(gamma > 0, beta / gamma, 0)
+
+    return pd.DataFrame({'Date': df['Date'], 'beta': beta, 'gamma': gamma, 'mu': mu, 'R0': R0})
+
+# Estimates of the global day_wise series, computed once
+@lru_cache(maxsize=1)
+def get_day_wise_parameters():
+    return estimate_time_varying_parameters()
 
 # Function to update parameters dynamically
 def update_parameters(day):
-    df = pd.read_csv('day_wise.csv')
+    parameters = get_day_wise_parameters()
     if day > 1:
-        new_recoveries = df['Recovered'].iloc[day] - df['Recovered'].iloc[day - 1]
-        new_deaths = df['Deaths'].iloc[day] - df['Deaths'].iloc[day - 1]
-
-        gamma = new_recoveries / I[day - 1] if I[day - 1] > 0 else 0
-        mu = new_deaths / I[day - 1] if I[day - 1] > 0 else 0
-        beta = (df['Active'].iloc[day] - df['Active'].iloc[day - 1] + mu * I[day - 1] + gamma * I[day - 1]) / (S[day - 1] * I[day - 1] / N) if S[day - 1] * I[day - 1] > 0 else 0
-    else:
-        beta, gamma, mu = 0, 0, 0
-    return beta, gamma, mu
+        return parameters['beta'].iloc[day], parameters['gamma'].iloc[day], parameters['mu'].iloc[day]
+    return 0, 0, 0
+
+# Summary of R0 over all days from day 1 on, the average is the one get_R0 always printed
+def summarize_R0(parameters=None):
+    if parameters is None:
+        parameters = get_day_wise_parameters()
+    R0_values = parameters['R0'].to_numpy()[1:]
+    return {
+        'average': sum(R0_values.tolist()) / len(R0_values),
+        'median': float(np.median(R0_values)),
+        'std': float(np.std(R0_values)),
+        'min': float(R0_values.min()),
+        'max': float(R0_values.max()),
+        'days': len(R0_values),
+    }
 
 def get_R0():
     # Compute R0
-    df = get_data_frame_sir()
-    days = len(df)
-    R0_values = [update_parameters(t)[0] / update_parameters(t)[1] if update_parameters(t)[1] > 0 else 0 for t in range(1, days)]
-    average_R0 = sum(R0_values) / len(R0_values) 
-    print(f'Average R0: {average_R0:.2f}')
-
+    summary = summarize_R0()
+    print(f'Average R0: {summary["average"]:.2f}')
+    return summary
@@ -0,0 +1,22 @@
+import importlib
+
+
+# Stand-in for a module that is only imported on first attribute access,
+# so importing the dashboard modules does not import matplotlib or plotly
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attribute):
+        if attribute == "_name":
+            raise AttributeError(attribute)
+        module = importlib.import_module(self._name)
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}>"
+
+
+# Return a lazy stand-in for the module with the given name
+def lazy_import(name):
+    return LazyModule(name)
@@ -0,0 +1,229 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from covid_trace import traced
+from covid_schema import read_panel_csv
+
+csv_path = "cleaned_complete.csv"
+
+# Bump when the layout of the binary cache changes
+CACHE_FORMAT = 2
+
+_panel = None
+
+
+# Holds the cleaned data sorted once by country and date, with an offset index per country
+class PanelStore:
+    def __init__(self, df, version=None):
+        # Stable sort so rows of the same country keep their date order
+        df = df.sort_values(["Country.Region", "Date"], kind="mergesort").reset_index(drop=True)
+        self.df = df
+        self.version = version
+
+        # Contiguous column arrays, a country's rows are a zero-copy slice of these
+        self.columns = {column: get_column_array(df[column]) for column in df.columns}
+
+        # Find where every run of the same country starts and stops
+        countries = self.columns["Country.Region"]
+        if len(countries):
+            starts = np.flatnonzero(np.r_[True, countries[1:] != countries[:-1]])
+        else:
+            starts = np.array([], dtype=np.int64)
+        stops = np.r_[starts[1:], len(countries)].astype(np.int64)
+
+        self.countries = [str(country) for country in countries[starts]]
+        self.offsets = {country: (int(start), int(stop)) for country, start, stop in zip(self.countries, starts, stops)}
+
+    # Panel over a frame that is already sorted by country and date, with the offsets of every
+    # country known, e.g. memory mapped by covid_dataplane. Nothing is copied or sorted.
+    @classmethod
+    def from_sorted(cls, df, countries, offsets, version=None):
+        panel = cls.__new__(cls)
+        panel.df = df
+        panel.version = version
+        panel.columns = {column: get_column_array(df[column]) for column in df.columns}
+        panel.countries = countries
+        panel.offsets = offsets
+        return panel
+
+    def __contains__(self, country):
+        return country in self.offsets
+
+    def __len__(self):
+        return len(self.df)
+
+    # Row range of a country in the sorted panel, None if the country is unknown
+    def get_slice(self, country):
+        offset = self.offsets.get(country)
+        if offset is None:
+            return None
+        return slice(*offset)
+
+    # Zero-copy view of one column for a country
+    def get_column(self, country, column):
+        rows = self.get_slice(country)
+        if rows is None:
+            return self.columns[column][:0]
+        return self.columns[column][rows]
+
+    # Rows of a country as a DataFrame, copy it before adding columns
+    def get_country_frame(self, country):
+        rows = self.get_slice(country)
+        if rows is None:
+            return self.df.iloc[:0]
+        return self.df.iloc[rows]
+
+
+# Values of a column as a contiguous array: categories as a Categorical over their codes,
+# nullable integers as floats with NaN where they are missing
+def get_column_array(values):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.array
+    if isinstance(values.dtype, pd.api.extensions.ExtensionDtype) and values.dtype.kind in "iu":
+        return values.to_numpy(dtype=np.float64, na_value=np.nan)
+    return np.ascontiguousarray(values.to_numpy())
+
+
+# Directory next to the CSV that holds its binary columns
+def get_cache_dir(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f".{os.path.splitext(name)[0]}.cache")
+
+# SHA-1 of a file, read in blocks
+def get_file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Write every column of the frame as a .npy file, strings as integer codes plus their categories
+def write_column_cache(df, cache_dir, source):
+    os.makedirs(cache_dir, exist_ok=True)
+    columns = []
+    for i, column in enumerate(df.columns):
+        values = df[column]
+        file_name = f"{source['sha1'][:12]}_{i}.npy"
+        entry = {"name": column, "file": file_name, "dtype": str(values.dtype)}
+        if values.dtype.kind == "M":
+            entry["kind"] = "datetime"
+            array = values.to_numpy().view(np.int64)
+        elif isinstance(values.dtype, pd.CategoricalDtype):
+            entry["kind"] = "category"
+            entry["categories"] = [str(category) for category in values.cat.categories]
+            array = values.cat.codes.to_numpy().astype(np.int32)
+        elif isinstance(values.dtype, pd.api.extensions.ExtensionDtype) and values.dtype.kind in "iu":
+            # Nullable integers, the values with 0 where they are missing and the mask of missing values
+            entry["kind"] = "nullable"
+            entry["mask"] = f"{source['sha1'][:12]}_{i}_mask.npy"
+            mask = values.isna().to_numpy()
+            np.save(os.path.join(cache_dir, entry["mask"]), mask)
+            array = values.fillna(0).to_numpy(dtype=values.dtype.numpy_dtype)
+        elif values.dtype.kind in "biuf":
+            entry["kind"] = "numeric"
+            array = values.to_numpy()
+        else:
+            entry["kind"] = "strings"
+            codes, categories = pd.factorize(values, use_na_sentinel=True)
+            entry["categories"] = [str(category) for category in categories]
+            array = codes.astype(np.int32)
+        np.save(os.path.join(cache_dir, file_name), np.ascontiguousarray(array))
+        columns.append(entry)
+
+    # The metadata is written last, so a half written cache is never used
+    meta = {"format": CACHE_FORMAT, "source": source, "columns": columns}
+    temporary = os.path.join(cache_dir, f"meta.json.{os.getpid()}")
+    with open(temporary, "w") as file:
+        json.dump(meta, file)
+    os.replace(temporary, os.path.join(cache_dir, "meta.json"))
+
+    # Remove column files of older versions
+    used = {entry[key] for entry in columns for key in ("file", "mask") if key in entry}
+    for file_name in os.listdir(cache_dir):
+        if file_name.endswith(".npy") and file_name not in used:
+            try:
+                os.remove(os.path.join(cache_dir, file_name))
+            except OSError:
+                pass
+
+# Build the frame from the memory mapped columns of the cache
+def read_column_cache(cache_dir, meta):
+    data = {}
+    for entry in meta["columns"]:
+        array = np.load(os.path.join(cache_dir, entry["file"]), mmap_mode="r")
+        if entry["kind"] == "datetime":
+            data[entry["name"]] = array.view(entry["dtype"])
+        elif entry["kind"] == "numeric":
+            data[entry["name"]] = array
+        elif entry["kind"] == "category":
+            dtype = pd.CategoricalDtype(entry["categories"])
+            data[entry["name"]] = pd.Categorical.from_codes(np.asarray(array), dtype=dtype)
+        elif entry["kind"] == "nullable":
+            mask = np.load(os.path.join(cache_dir, entry["mask"]))
+            data[entry["name"]] = pd.arrays.IntegerArray(np.asarray(array), mask)
+        else:
+            categorical = pd.Categorical.from_codes(np.asarray(array), categories=entry["categories"])
+            data[entry["name"]] = pd.Series(categorical).astype(entry["dtype"])
+    return pd.DataFrame(data, copy=False)
+
+# Read cleaned_complete.csv with the types of covid_schema, through a binary cache of its columns. The cache is used
+# while the size and modification time of the CSV match, or its hash when those changed.
+@traced("load")
+def read_cleaned_complete(path=csv_path):
+    stat = os.stat(path)
+    cache_dir = get_cache_dir(path)
+    meta_path = os.path.join(cache_dir, "meta.json")
+
+    meta = None
+    try:
+        with open(meta_path) as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        pass
+
+    if meta is not None and meta.get("format") == CACHE_FORMAT:
+        source = meta["source"]
+        unchanged = source["size"] == stat.st_size and source["mtime_ns"] == stat.st_mtime_ns
+        if not unchanged and source["size"] == stat.st_size and source["sha1"] == get_file_hash(path):
+            # Same content with a new modification time, e.g. after a checkout
+            source["mtime_ns"] = stat.st_mtime_ns
+            unchanged = True
+            try:
+                temporary = f"{meta_path}.{os.getpid()}"
+                with open(temporary, "w") as file:
+                    json.dump(meta, file)
+                os.replace(temporary, meta_path)
+            except OSError:
+                pass
+        if unchanged:
+            try:
+                return read_column_cache(cache_dir, meta)
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+
+    # No usable cache, parse the CSV and write a new one
+    df = read_panel_csv(path)
+    source = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": get_file_hash(path)}
+    try:
+        write_column_cache(df, cache_dir, source)
+    except OSError:
+        pass  # A read-only checkout still works, just without the cache
+    return df
+
+# Version of the CSV on disk, changes whenever the file is rewritten
+def get_csv_version(path=csv_path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+# Return the shared panel store, attaching to the published version when the CSV has changed.
+# Imported here because covid_dataplane builds on this module.
+def get_panel():
+    global _panel
+    version = get_csv_version(csv_path)
+    if _panel is None or _panel.version != version:
+        from covid_dataplane import attach_panel
+        _panel = attach_panel(csv_path)
+    return _panel
@@ -0,0 +1,67 @@
+import os
+import threading
+import numpy as np
+from covid_db import fetch_all
+
+db_path = "covid_database.db"
+
+# Countries that have a different name in the database
+COUNTRY_ALIASES = {
+    "US": "USA",
+    "Holy See": "Vatican City",
+    "United Kingdom": "UK"
+}
+
+
+# Population of every country, loaded from worldometer_data in one query and
+# loaded again when the database file changes
+class PopulationResolver:
+    def __init__(self, path=db_path):
+        self.path = path
+        self.version = None
+        self.populations = {}
+        self._lock = threading.Lock()
+
+    # Load the populations again if the database file has changed since the last load
+    def refresh(self):
+        stat = os.stat(self.path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version == self.version:
+            return
+        with self._lock:
+            if version == self.version:
+                return
+            rows = fetch_all("SELECT `Country.Region`, Population FROM worldometer_data", path=self.path)
+
+            # Keep the first row of a country, like fetchone() does for a single country
+            populations = {}
+            for country, population in rows:
+                populations.setdefault(country, population)
+            self.populations = populations
+            self.version = version
+
+    # Name of a country as used in the database
+    def resolve_name(self, country):
+        return COUNTRY_ALIASES.get(country, country)
+
+    # Population of one country, None if it is not in the database
+    def lookup(self, country):
+        self.refresh()
+        return self.populations.get(self.resolve_name(country))
+
+    # Population of many countries as a float array, NaN where it is not in the database
+    def lookup_many(self, countries):
+        self.refresh()
+        populations = self.populations
+        values = [populations.get(COUNTRY_ALIASES.get(country, country)) for country in countries]
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+
+
+_resolver = None
+
+# Return the shared population resolver
+def get_population_resolver():
+    global _resolver
+    if _resolver is None:
+        _resolver = PopulationResolver(db_path)
+    return _resolver
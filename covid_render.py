@@ -0,0 +1,124 @@
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import covid_sird_model
+from covid_cache import LRUCache
+from covid_trace import traced
+
+# The six figures of the SIRD tab
+SIRD_FIGURES = ["sird_model", "smooth_sird", "R0", "death_rate", "alpha", "beta"]
+
+# Same settings st.pyplot uses when it saves a figure
+SAVE_OPTIONS = {"dpi": 200, "bbox_inches": "tight"}
+
+# Rendered images keyed by country, figure, format and data version
+render_cache = LRUCache(maxsize=256, name="render_cache")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Renders done in the pool and pools that broke, benchmarks/render_pool.py checks them
+pool_stats = {"parallel_renders": 0, "broken_pools": 0}
+
+
+# Build one figure of the SIRD tab, None when there is no data for it
+def build_sird_figure(country, kind):
+    if kind == "sird_model":
+        return covid_sird_model.plot_sird_model(country)
+    if kind == "smooth_sird":
+        return covid_sird_model.plot_smooth_sird(country)
+
+    df = covid_sird_model.estimate_parameters(country)
+    plot_functions = {
+        "R0": covid_sird_model.plot_R0_trajectory,
+        "death_rate": covid_sird_model.plot_death_rate,
+        "alpha": covid_sird_model.plot_alpha,
+        "beta": covid_sird_model.plot_beta,
+    }
+    return plot_functions[kind](df, country)
+
+# Build a figure and save it as PNG or SVG bytes, runs inside the worker processes
+def render_sird_figure(country, kind, fmt="png"):
+    fig = build_sird_figure(country, kind)
+    if fig is None:
+        return None
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt, **SAVE_OPTIONS)
+    return buffer.getvalue()
+
+# Hide the main module while workers are started. A spawned worker imports the __main__ of the
+# parent again, under streamlit run that is the dashboard script, which would render the dashboard
+# in every worker and import the repo's streamlit.py in place of the package. With a stub without
+# __file__ the workers only import covid_render and what it needs.
+@contextlib.contextmanager
+def hidden_main():
+    main = sys.modules.get("__main__")
+    stub = types.ModuleType("__main__")
+    sys.modules["__main__"] = stub
+    try:
+        yield
+    finally:
+        # A rerun of Streamlit in another thread may have set a new main module in the meantime
+        if sys.modules.get("__main__") is stub:
+            sys.modules["__main__"] = main
+
+# Process pool shared by all sessions, started on first use.
+# Spawned workers do not inherit the threads of the Streamlit server.
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = min(len(SIRD_FIGURES), os.cpu_count() or 1)
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(cancel_futures=True)
+            _executor = None
+
+# Render the figures of the SIRD tab for a country at the same time in the process pool.
+# Returns a dict of figure name to image bytes (None when there is no data).
+# Figures rendered before for the same data version come from the cache.
+@traced("render")
+def render_sird_tab(country, kinds=SIRD_FIGURES, fmt="png", parallel=True):
+    version = covid_sird_model.get_data_version()
+    not_cached = object()
+    images = {}
+    missing = []
+    for kind in kinds:
+        image = render_cache.get((country, kind, fmt, version), not_cached)
+        if image is not_cached:
+            missing.append(kind)
+        else:
+            images[kind] = image
+
+    rendered = {}
+    if parallel and len(missing) > 1:
+        try:
+            executor = get_executor()
+            # The pool starts its workers in submit, one at a time as they are needed
+            with _executor_lock, hidden_main():
+                futures = {kind: executor.submit(render_sird_figure, country, kind, fmt) for kind in missing}
+            rendered = {kind: future.result() for kind, future in futures.items()}
+            pool_stats["parallel_renders"] += 1
+        except BrokenProcessPool:
+            # A worker died, start a new pool next time and render here for now
+            pool_stats["broken_pools"] += 1
+            shutdown_executor()
+            rendered = {}
+    for kind in missing:
+        if kind not in rendered:
+            rendered[kind] = render_sird_figure(country, kind, fmt)
+        render_cache.put((country, kind, fmt, version), rendered[kind])
+        images[kind] = rendered[kind]
+
+    return images
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+# Columns of cleaned_complete.csv by type
+COUNT_COLUMNS = ["Confirmed", "Deaths", "Recovered", "Active"]
+CATEGORY_COLUMNS = ["Province.State", "Country.Region", "WHO.Region"]
+COORDINATE_COLUMNS = ["Lat", "Long"]
+DATE_COLUMN = "Date"
+
+# Columns where a missing value stays missing (NA) instead of becoming 0
+NULLABLE_COLUMNS = ["Province.State"]
+
+# Values older versions of data_wrangling.py wrote for "no province"
+MISSING_PROVINCES = ["0", "0.0"]
+
+# Dtypes to parse the CSV with, the counts are made integers afterwards
+CSV_DTYPES = {
+    **{column: "category" for column in CATEGORY_COLUMNS},
+    **{column: "float64" for column in COORDINATE_COLUMNS + COUNT_COLUMNS},
+}
+
+
+# Smallest integer type the counts fit in, int32 unless a count is above 2^31
+def get_count_dtype(values):
+    if len(values) and np.nanmax(np.abs(values)) > np.iinfo(np.int32).max:
+        return "int64"
+    return "int32"
+
+# Counts as integers, or as nullable integers (Int32/Int64) when some are missing
+def cast_counts(df):
+    for column in COUNT_COLUMNS:
+        if column not in df.columns:
+            continue
+        values = df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+        dtype = get_count_dtype(values)
+        if np.isnan(values).any():
+            df[column] = df[column].astype(dtype.capitalize())
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+# Names and regions as categories with sorted categories, so sorting by them is alphabetical.
+# A province of "0" (or 0) means there is no province and becomes NA.
+def cast_categories(df):
+    for column in CATEGORY_COLUMNS:
+        if column not in df.columns:
+            continue
+        values = df[column]
+        if column in NULLABLE_COLUMNS:
+            values = values.astype(object)
+            values = values.where(values.notna() & ~values.astype(str).isin(MISSING_PROVINCES))
+        categories = sorted(str(value) for value in pd.unique(values.dropna()))
+        df[column] = values.astype(pd.CategoricalDtype(categories))
+    return df
+
+# Bring a frame with the columns of cleaned_complete.csv to the canonical types
+def apply_schema(df):
+    df = df.copy()
+    if DATE_COLUMN in df.columns:
+        df[DATE_COLUMN] = pd.to_datetime(df[DATE_COLUMN])
+    for column in COORDINATE_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype(np.float64)
+    cast_categories(df)
+    cast_counts(df)
+    return df
+
+# Read cleaned_complete.csv (or a raw feed with the same columns) with the canonical types
+def read_panel_csv(path):
+    df = pd.read_csv(path, dtype=CSV_DTYPES, parse_dates=[DATE_COLUMN], na_values={"Province.State": MISSING_PROVINCES})
+    return apply_schema(df)
+
+# Bytes per column of the CSV read without and with the schema, and the total saved
+def memory_report(path):
+    before = pd.read_csv(path, parse_dates=[DATE_COLUMN]).memory_usage(deep=True, index=False)
+    typed = read_panel_csv(path)
+    after = typed.memory_usage(deep=True, index=False)
+    report = pd.DataFrame({
+        "dtype": typed.dtypes.astype(str),
+        "bytes_before": before,
+        "bytes_after": after,
+    })
+    report.loc["Total"] = ["", before.sum(), after.sum()]
+    report["saved"] = 1 - report["bytes_after"] / report["bytes_before"]
+    return report
+
+
+if __name__ == "__main__":
+    report = memory_report("cleaned_complete.csv")
+    print(report.to_string(formatters={"saved": "{:.0%}".format}))
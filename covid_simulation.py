@@ -0,0 +1,103 @@
+import numpy as np
+from covid_panel import get_panel
+from covid_population import get_population_resolver
+
+
+# Daily changes of the SIRD difference equations, alpha is the loss of immunity.
+# Works on arrays, so every member of an ensemble is stepped at once.
+def sird_derivatives(S, I, R, D, beta, gamma, mu, alpha, N):
+    new_infections = beta * S * I / N
+    delta_S = alpha * R - new_infections
+    delta_I = new_infections - mu * I - gamma * I
+    delta_R = gamma * I - alpha * R
+    delta_D = mu * I
+    return delta_S, delta_I, delta_R, delta_D
+
+# One day forward with an Euler step (the same as the loop in load_sir) or a fourth order Runge-Kutta step
+def sird_step(state, beta, gamma, mu, alpha, N, method="euler"):
+    S, I, R, D = state
+    if method == "euler":
+        delta_S, delta_I, delta_R, delta_D = sird_derivatives(S, I, R, D, beta, gamma, mu, alpha, N)
+        return S + delta_S, I + delta_I, R + delta_R, D + delta_D
+    if method == "rk4":
+        k1 = sird_derivatives(S, I, R, D, beta, gamma, mu, alpha, N)
+        k2 = sird_derivatives(*(x + k / 2 for x, k in zip(state, k1)), beta, gamma, mu, alpha, N)
+        k3 = sird_derivatives(*(x + k / 2 for x, k in zip(state, k2)), beta, gamma, mu, alpha, N)
+        k4 = sird_derivatives(*(x + k for x, k in zip(state, k3)), beta, gamma, mu, alpha, N)
+        return tuple(x + (a + 2 * b + 2 * c + d) / 6 for x, a, b, c, d in zip(state, k1, k2, k3, k4))
+    raise ValueError(f"Unknown integration method: {method}")
+
+# Value of a parameter on a day: scalars and 1D arrays (one value per member) are constant,
+# 2D arrays of shape (days, members) vary over time and keep their last value after the end
+def parameter_on_day(parameter, day):
+    if parameter.ndim == 2:
+        return parameter[min(day, len(parameter) - 1)]
+    return parameter
+
+# Simulate an ensemble of SIRD models and yield the states in blocks of chunk_days days.
+# Every block is a tuple (first_day, S, I, R, D) with arrays of shape (days in block, members),
+# the first block starts with the initial state on day 0. Only one block is kept in memory.
+def iter_simulate_sird(S0, I0, R0, D0, beta, gamma, mu, alpha, days, N=None, method="euler", chunk_days=64):
+    state = tuple(np.atleast_1d(np.asarray(x, dtype=np.float64)) for x in (S0, I0, R0, D0))
+    parameters = [np.asarray(p, dtype=np.float64) for p in (beta, gamma, mu, alpha)]
+
+    # Number of members, from the initial states and the parameters
+    members = np.broadcast_shapes(*(x.shape for x in state), *(p.shape[1:] if p.ndim == 2 else p.shape for p in parameters))
+    state = tuple(np.broadcast_to(x, members).copy() for x in state)
+    N = sum(state) if N is None else np.broadcast_to(np.asarray(N, dtype=np.float64), members)
+
+    block = np.empty((4, min(chunk_days, days + 1)) + members)
+    first_day = 0
+    filled = 0
+    for day in range(days + 1):
+        if day > 0:
+            values = [parameter_on_day(p, day - 1) for p in parameters]
+            state = sird_step(state, *values, N, method=method)
+        block[:, filled] = state
+        filled += 1
+        if filled == block.shape[1] or day == days:
+            yield (first_day, *block[:, :filled].copy())
+            first_day += filled
+            filled = 0
+
+# Simulate an ensemble of SIRD models and return S, I, R and D with shape (days + 1, members)
+def simulate_sird(S0, I0, R0, D0, beta, gamma, mu, alpha, days, N=None, method="euler"):
+    blocks = list(iter_simulate_sird(S0, I0, R0, D0, beta, gamma, mu, alpha, days, N=N, method=method))
+    return tuple(np.concatenate([block[i] for block in blocks]) for i in range(1, 5))
+
+# Peak of the infections, the day of that peak and the final state of every member,
+# computed while streaming so the trajectories are never held in memory
+def summarize_ensemble(S0, I0, R0, D0, beta, gamma, mu, alpha, days, N=None, method="euler", chunk_days=64):
+    peak_infected = None
+    peak_day = None
+    for first_day, S, I, R, D in iter_simulate_sird(S0, I0, R0, D0, beta, gamma, mu, alpha, days, N=N, method=method, chunk_days=chunk_days):
+        block_peak = I.max(axis=0)
+        block_day = first_day + I.argmax(axis=0)
+        if peak_infected is None:
+            peak_infected, peak_day = block_peak, block_day
+        else:
+            higher = block_peak > peak_infected
+            peak_infected = np.where(higher, block_peak, peak_infected)
+            peak_day = np.where(higher, block_day, peak_day)
+    return {
+        "peak_infected": peak_infected,
+        "peak_day": peak_day,
+        "final_S": S[-1],
+        "final_I": I[-1],
+        "final_R": R[-1],
+        "final_D": D[-1],
+    }
+
+# Time-varying parameters from the output of estimate_parameters, with shape (days, 1)
+def parameters_from_estimates(df_parameters):
+    return {name: df_parameters[name].to_numpy(dtype=np.float64)[:, np.newaxis] for name in ["beta", "gamma", "mu", "alpha"]}
+
+# Initial state of countries from their last reported day: S, I, R, D and the population N
+def initial_state_from_panel(countries):
+    panel = get_panel()
+    stops = [panel.offsets[country][1] - 1 for country in countries]
+    I = panel.columns["Active"][stops].astype(np.float64)
+    R = panel.columns["Recovered"][stops].astype(np.float64)
+    D = panel.columns["Deaths"][stops].astype(np.float64)
+    N = get_population_resolver().lookup_many(countries)
+    return N - I - R - D, I, R, D, N
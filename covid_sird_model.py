@@ -1,57 +1,72 @@
-import sqlite3
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import plotly.express as px
-
-# Connect to the database/CSV
+from covid_lazy import lazy_import
+from covid_panel import get_panel
+from covid_smoothing import smooth
+from covid_cache import LRUCache
+from covid_population import get_population_resolver
+from covid_downsample import downsample
+from covid_trace import traced
+
+# matplotlib and plotly are only imported when the first plot is made. The figures are
+# made with the Figure class instead of pyplot, so they can be built in any thread or process
+mpl_figure = lazy_import("matplotlib.figure")
+px = lazy_import("plotly.express")
+
+# The database/CSV are only opened on first use
 db_path = "covid_database.db"
-connection = sqlite3.connect(db_path)
-df = pd.read_csv("cleaned_complete.csv")
+
+# Keep covid_sird_model.df working, it loads the panel on first access
+def __getattr__(name):
+    if name == "df":
+        return get_panel().df
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Estimated and smoothed frames shared by all plot functions
+parameter_cache = LRUCache(maxsize=64, name="parameter_cache")
 
  # Create a lit of all unique countries
+@traced("data")
 def creating_available_countries():
-    return sorted(df["Country.Region"].unique())
+    return list(get_panel().countries)
 
  # Get population from db
+@traced("data")
 def get_population_from_db(country):
-    connection = sqlite3.connect(db_path)
-    cursor = connection.cursor()
-    
-    country_mapping = {
-        "US": "USA",
-        "Holy See": "Vatican City", 
-        "United Kingdom": "UK"
-    }
-    
-    mapped_country = country_mapping.get(country, country)
-    
-    query = "SELECT Population FROM worldometer_data WHERE `Country.Region` = ?"
-    cursor.execute(query, (mapped_country,))
-    result = cursor.fetchone()
-    
-    connection.close()
-    
-    if result:
-        return result[0]
-    else:
-        return None
+    return get_population_resolver().lookup(country)
+
+# Version of the CSV and the database, cached frames are only reused for the same version
+def get_data_version():
+    resolver = get_population_resolver()
+    resolver.refresh()
+    return (get_panel().version, resolver.version)
+
+# Get a frame from the parameter cache, callers get a copy they are free to change
+def get_cached_frame(kind, country, compute):
+    frame = parameter_cache.get_or_compute((kind, country, get_data_version()), compute)
+    return None if frame is None else frame.copy()
 
 # Estimate parameters for the SIRD Model
+@traced("data")
 def estimate_parameters(country):
+    return get_cached_frame("parameters", country, lambda: compute_parameters(country))
+
+# Estimate parameters for the SIRD Model without the cache
+@traced("data")
+def compute_parameters(country):
     actual_population = get_population_from_db(country)
     if actual_population is None:
         return pd.DataFrame()  # Return empty DataFrame if population data is not found
     
-    # Filter data for the selected country
-    country_df = df[df["Country.Region"] == country].copy()
+    # Get the rows of the selected country, already sorted by date
+    country_df = get_panel().get_country_frame(country).copy()
     if country_df.empty:
         return pd.DataFrame()
     
-    # Convert Date column to datetime
-    country_df["Date"] = pd.to_datetime(country_df["Date"])
-    country_df.sort_values("Date", inplace=True)
-    
+    # Counts as floats like estimate_parameters_all, S * Active overflows the int32 counts otherwise
+    for column in ["Active", "Recovered", "Deaths"]:
+        country_df[column] = country_df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+
     # Use actual population from a country
     N = actual_population
     country_df["S"] = N - (country_df["Active"] + country_df["Recovered"] + country_df["Deaths"])
@@ -78,28 +93,110 @@ def estimate_parameters(country):
     
     return country_df[["Date", "alpha", "beta", "gamma", "mu", "R0"]]
 
+# Clip negative values to 0 and replace NaN with 0, the same as .clip(lower=0).fillna(0)
+def clip_and_fill(values):
+    values = np.where(values < 0, 0.0, values)
+    return np.where(np.isnan(values), 0.0, values)
+
+# Difference with the previous day, 0 on the first day of every country
+def grouped_diff(values, first_rows):
+    delta = np.zeros_like(values)
+    delta[1:] = np.diff(values)
+    delta[first_rows] = 0.0
+    return np.where(np.isnan(delta), 0.0, delta)
+
+# Estimate parameters for the SIRD Model for all countries at once
+@traced("data")
+def estimate_parameters_all(countries=None):
+    panel = get_panel()
+
+    # Countries with a population in the database, in panel order
+    selected = panel.countries
+    if countries is not None:
+        countries = set(countries)
+        selected = [country for country in selected if country in countries]
+    populations = get_population_resolver().lookup_many(selected)
+    has_population = ~np.isnan(populations)
+    populations = populations[has_population]
+    selected = [country for country, found in zip(selected, has_population) if found]
+    if not selected:
+        return pd.DataFrame(columns=["Country.Region", "Date", "alpha", "beta", "gamma", "mu", "R0"])
+
+    # Row positions of the selected countries and the first row of every country
+    offsets = [panel.offsets[country] for country in selected]
+    lengths = np.array([stop - start for start, stop in offsets])
+    rows = np.concatenate([np.arange(start, stop) for start, stop in offsets])
+    first_rows = np.r_[0, np.cumsum(lengths)[:-1]]
+
+    active = panel.columns["Active"][rows].astype(np.float64)
+    recovered = panel.columns["Recovered"][rows].astype(np.float64)
+    deaths = panel.columns["Deaths"][rows].astype(np.float64)
+
+    # Use actual population from a country for every row
+    N = np.repeat(populations, lengths)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        S = N - (active + recovered + deaths)
+
+        # Compute daily changes
+        delta_D = grouped_diff(deaths, first_rows)
+        delta_R = grouped_diff(recovered, first_rows)
+        delta_I = grouped_diff(active, first_rows)
+
+        # Same formulas as estimate_parameters
+        mu = clip_and_fill(delta_D / active)
+        gamma = np.full(len(rows), 1 / 4.5)
+        beta = clip_and_fill((delta_I + gamma * active + mu * active) / ((S * active) / N))
+        alpha = clip_and_fill(delta_R / recovered)
+        R0 = clip_and_fill(beta / gamma)
+
+    return pd.DataFrame({
+        "Country.Region": panel.columns["Country.Region"][rows],
+        "Date": panel.columns["Date"][rows],
+        "alpha": alpha,
+        "beta": beta,
+        "gamma": gamma,
+        "mu": mu,
+        "R0": R0,
+    })
+
 # Smoothen the SIRD parameter functions
+@traced("data")
 def get_smooth_function(country):
-    # Getting the dataframe and selecting the amount of iterations
-    df_parameters = estimate_parameters(country)
-    n = 10
+    return get_cached_frame("smoothed_parameters", country, lambda: compute_smooth_function(country))
 
-    # Creating new columns for the smoothed parameters
-    df_parameters['smoothed_alpha'] = df_parameters['alpha'].rolling(window=3, center=True).mean()
-    df_parameters['smoothed_beta'] = df_parameters['beta'].rolling(window=3, center=True).mean()
-    df_parameters['smoothed_mu'] = df_parameters['mu'].rolling(window=3, center=True).mean()
-    df_parameters['smoothed_R0'] = df_parameters['R0'].rolling(window=3, center=True).mean()
+# Smoothen the SIRD parameter functions without the cache
+@traced("data")
+def compute_smooth_function(country):
+    # Getting the dataframe
+    df_parameters = estimate_parameters(country)
+    columns = ["alpha", "beta", "mu", "R0"]
 
-    # Iterating n times for a smoother function
-    for i in range(0,n):
-        df_parameters['smoothed_mu'] = df_parameters['smoothed_mu'].rolling(window=3, center=True).mean()
-        df_parameters['smoothed_alpha'] = df_parameters['smoothed_alpha'].rolling(window=3, center=True).mean()
-        df_parameters['smoothed_beta'] = df_parameters['smoothed_beta'].rolling(window=3, center=True).mean()
-        df_parameters['smoothed_R0'] = df_parameters['smoothed_R0'].rolling(window=3, center=True).mean()
+    # Creating new columns for the smoothed parameters, in one pass over all columns
+    smoothed = smooth(df_parameters[columns].to_numpy())
+    for i, column in enumerate(columns):
+        df_parameters[f"smoothed_{column}"] = smoothed[:, i]
     
     return df_parameters
 
+# Smoothen the SIRD parameter functions for all countries at once
+@traced("data")
+def get_smooth_function_all(countries=None, method="rolling"):
+    df_parameters = estimate_parameters_all(countries)
+    columns = ["alpha", "beta", "mu", "R0"]
+
+    # First row of every country, the smoothing window does not cross countries
+    country_names = df_parameters["Country.Region"].to_numpy()
+    group_starts = np.flatnonzero(np.r_[True, country_names[1:] != country_names[:-1]]) if len(country_names) else []
+
+    smoothed = smooth(df_parameters[columns].to_numpy(), method=method, group_starts=group_starts)
+    for i, column in enumerate(columns):
+        df_parameters[f"smoothed_{column}"] = smoothed[:, i]
+
+    return df_parameters
+
 # Generate an R0 trajectory plot for the selected country.
+@traced("plot")
 def plot_R0_trajectory(df, country):
     if df.empty:
         return None 
@@ -107,18 +204,24 @@ def plot_R0_trajectory(df, country):
     # Get dataframe of the smoothed function
     df_smoothed = get_smooth_function(country)
 
-    fig, ax = plt.subplots(figsize=(10, 5))
-    ax.plot(df["Date"], df["R0"], linestyle="-", color="lightblue", label=f"Reproduction rate ($R_0$)")
-    ax.plot(df_smoothed["Date"], df_smoothed["smoothed_R0"], linestyle="-", color="red", label="Smoothed reproduction rate ($R_0$)")
+    # Long series are drawn from the points LTTB keeps
+    raw_line = downsample(df["Date"], [df["R0"]])[0]
+    smoothed_line = downsample(df_smoothed["Date"], [df_smoothed["smoothed_R0"]])[0]
+
+    fig = mpl_figure.Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    ax.plot(*raw_line, linestyle="-", color="lightblue", label=f"Reproduction rate ($R_0$)")
+    ax.plot(*smoothed_line, linestyle="-", color="red", label="Smoothed reproduction rate ($R_0$)")
     ax.set_xlabel("Date")
     ax.set_ylabel(rf"Reproduction Rate ($R_0$)")
     ax.set_title(rf"Reproduction rate ($R_0$) Over Time for {country}")
     ax.legend()
-    plt.xticks(rotation=45)
+    ax.tick_params(axis="x", labelrotation=45)
 
     return fig  
 
 # Generate a death rate trajectory plot for the selected country.
+@traced("plot")
 def plot_death_rate(df, country):
     if df.empty:
         return None  
@@ -126,18 +229,24 @@ def plot_death_rate(df, country):
     # Get dataframe of the smoothed function
     df_smoothed = get_smooth_function(country)
 
-    fig, ax = plt.subplots(figsize=(10, 5))
-    ax.plot(df["Date"], df["mu"], linestyle="-", color="lightblue", label=f"Death Rate ($\mu$)")
-    ax.plot(df_smoothed["Date"], df_smoothed["smoothed_mu"], linestyle="-", color="red", label=f"Smoothed Death Rate ($\mu$)")
+    # Long series are drawn from the points LTTB keeps
+    raw_line = downsample(df["Date"], [df["mu"]])[0]
+    smoothed_line = downsample(df_smoothed["Date"], [df_smoothed["smoothed_mu"]])[0]
+
+    fig = mpl_figure.Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    ax.plot(*raw_line, linestyle="-", color="lightblue", label=f"Death Rate ($\mu$)")
+    ax.plot(*smoothed_line, linestyle="-", color="red", label=f"Smoothed Death Rate ($\mu$)")
     ax.set_xlabel("Date")
     ax.set_ylabel(rf"Death Rate ($\mu$)")
     ax.set_title(rf"Death Rate ($\mu$) Over Time for {country}")
     ax.legend()
-    plt.xticks(rotation=45)
+    ax.tick_params(axis="x", labelrotation=45)
     
     return fig
 
 # Plot alpha for a slected country
+@traced("plot")
 def plot_alpha(df, country):
     if df.empty:
         return None  
@@ -145,18 +254,24 @@ def plot_alpha(df, country):
     # Get dataframe of the smoothed function
     df_smoothed = get_smooth_function(country)
 
-    fig, ax = plt.subplots(figsize=(10, 5))
-    ax.plot(df["Date"], df["alpha"], linestyle="-", color="lightblue", label=rf"Alpha ($\alpha$)")
-    ax.plot(df_smoothed["Date"], df_smoothed["smoothed_alpha"], linestyle="-", color="red", label=rf"Smoothed Alpha ($\alpha$)")
+    # Long series are drawn from the points LTTB keeps
+    raw_line = downsample(df["Date"], [df["alpha"]])[0]
+    smoothed_line = downsample(df_smoothed["Date"], [df_smoothed["smoothed_alpha"]])[0]
+
+    fig = mpl_figure.Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    ax.plot(*raw_line, linestyle="-", color="lightblue", label=rf"Alpha ($\alpha$)")
+    ax.plot(*smoothed_line, linestyle="-", color="red", label=rf"Smoothed Alpha ($\alpha$)")
     ax.set_xlabel("Date")
     ax.set_ylabel(rf"Alpha ($\alpha$)")
     ax.set_title(rf"Alpha ($\alpha$) Over Time for {country}")
     ax.legend()
-    plt.xticks(rotation=45)
+    ax.tick_params(axis="x", labelrotation=45)
     
     return fig
 
 # Plot beta for a selected country
+@traced("plot")
 def plot_beta(df, country):
     if df.empty:
         return None  
@@ -164,18 +279,24 @@ def plot_beta(df, country):
     # Get dataframe of the smoothed function
     df_smoothed = get_smooth_function(country)
 
-    fig, ax = plt.subplots(figsize=(10, 5))
-    ax.plot(df["Date"], df["beta"], linestyle="-", color="lightblue", label=rf"Beta ($\beta$)")
-    ax.plot(df_smoothed["Date"], df_smoothed["smoothed_beta"], linestyle="-", color="red", label=rf"Smoothed Beta ($\beta$)")
+    # Long series are drawn from the points LTTB keeps
+    raw_line = downsample(df["Date"], [df["beta"]])[0]
+    smoothed_line = downsample(df_smoothed["Date"], [df_smoothed["smoothed_beta"]])[0]
+
+    fig = mpl_figure.Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    ax.plot(*raw_line, linestyle="-", color="lightblue", label=rf"Beta ($\beta$)")
+    ax.plot(*smoothed_line, linestyle="-", color="red", label=rf"Smoothed Beta ($\beta$)")
     ax.set_xlabel("Date")
     ax.set_ylabel(rf"Beta ($\beta$)")
     ax.set_title(rf"Beta ($\beta$) Over Time for {country}")
     ax.legend()
-    plt.xticks(rotation=45)
+    ax.tick_params(axis="x", labelrotation=45)
     
     return fig
 
 # Plot the SIRD Model for a selected country
+@traced("plot")
 def plot_sird_model(selected_country):
     country_df = get_smooth_function_SIRD(selected_country)
 
@@ -185,66 +306,66 @@ def plot_sird_model(selected_country):
     country_df["New_Recovered"] = country_df["Recovered"].diff().clip(lower=0).fillna(0)
 
     # Plot data
-    fig, ax = plt.subplots(figsize=(10, 5))
-    ax.plot(country_df["Date"], country_df["New_Cases"], label="Infected", color="blue")
-    ax.plot(country_df["Date"], country_df["New_Deaths"], label="Deaths", color="red")
-    ax.plot(country_df["Date"], country_df["New_Recovered"], label="Recovered", color="green")
+    fig = mpl_figure.Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    cases, deaths, recovered = downsample(country_df["Date"], [country_df["New_Cases"], country_df["New_Deaths"], country_df["New_Recovered"]])
+    ax.plot(*cases, label="Infected", color="blue")
+    ax.plot(*deaths, label="Deaths", color="red")
+    ax.plot(*recovered, label="Recovered", color="green")
     ax.set_xlabel("Date")
     ax.set_ylabel("Cases")
     ax.set_title(f"COVID-19 Cases in {selected_country}")
     ax.legend()
-    plt.xticks(rotation=45)
+    ax.tick_params(axis="x", labelrotation=45)
 
     return fig
 
 # Get the smooth function fot a selected country
+@traced("data")
 def get_smooth_function_SIRD(selected_country):
-    # Load data and selecting amount of iterations
-    df = pd.read_csv("cleaned_complete.csv", parse_dates=["Date"])
-    n = 10
+    return get_cached_frame("smoothed_sird", selected_country, lambda: compute_smooth_function_SIRD(selected_country))
 
-    # Filter data for selected country
-    country_df = df[df["Country.Region"] == selected_country].copy()
+# Get the smooth function for a selected country without the cache
+@traced("data")
+def compute_smooth_function_SIRD(selected_country):
+    # Get the rows of the selected country, already sorted by date
+    country_df = get_panel().get_country_frame(selected_country).copy()
 
     if country_df.empty:
         return None  # Return None if no data is available for the selected country
 
-    # Sort by date to ensure correct calculations
-    country_df.sort_values("Date", inplace=True)
-
     # Compute daily new cases, deaths, and recovered
     country_df["New_Cases"] = country_df["Confirmed"].diff().clip(lower=0).fillna(0)
     country_df["New_Deaths"] = country_df["Deaths"].diff().clip(lower=0).fillna(0)
     country_df["New_Recovered"] = country_df["Recovered"].diff().clip(lower=0).fillna(0)
 
     # Creating new column for the smoothed new cases, deaths and recovered
-    country_df['smoothed_cases'] = country_df['New_Cases'].rolling(window=3, center=True).mean()
-    country_df['smoothed_deaths'] = country_df['New_Deaths'].rolling(window=3, center=True).mean()
-    country_df['smoothed_recovered'] = country_df['New_Recovered'].rolling(window=3, center=True).mean()
-
-    for i in range(0,n):
-        country_df['smoothed_cases'] = country_df['smoothed_cases'].rolling(window=3, center=True).mean()
-        country_df['smoothed_deaths'] = country_df['smoothed_deaths'].rolling(window=3, center=True).mean()
-        country_df['smoothed_recovered'] = country_df['smoothed_recovered'].rolling(window=3, center=True).mean()
+    smoothed = smooth(country_df[["New_Cases", "New_Deaths", "New_Recovered"]].to_numpy())
+    country_df['smoothed_cases'] = smoothed[:, 0]
+    country_df['smoothed_deaths'] = smoothed[:, 1]
+    country_df['smoothed_recovered'] = smoothed[:, 2]
     
     return country_df
 
 # Plot the smoothened SIRD model
+@traced("plot")
 def plot_smooth_sird(selected_country):
     # Loading data 
     country_df = get_smooth_function_SIRD(selected_country)
 
     # Plot data
-    fig, ax = plt.subplots(figsize=(10, 5))
-    ax.plot(country_df["Date"], country_df["smoothed_cases"], label="Infected", color="blue")
-    ax.plot(country_df["Date"], country_df["smoothed_deaths"], label="Deaths", color="red")
-    ax.plot(country_df["Date"], country_df["smoothed_recovered"], label="Recovered", color="green")
+    fig = mpl_figure.Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    cases, deaths, recovered = downsample(country_df["Date"], [country_df["smoothed_cases"], country_df["smoothed_deaths"], country_df["smoothed_recovered"]])
+    ax.plot(*cases, label="Infected", color="blue")
+    ax.plot(*deaths, label="Deaths", color="red")
+    ax.plot(*recovered, label="Recovered", color="green")
     
     ax.set_xlabel("Date")
     ax.set_ylabel("Cases")
     ax.set_title(f"Smoothed COVID-19 Cases in {selected_country}")
     ax.legend()
-    plt.xticks(rotation=45)
+    ax.tick_params(axis="x", labelrotation=45)
 
     return fig
 
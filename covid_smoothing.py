@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# The SIRD tab smooths with rolling(window=3, center=True).mean() applied 11 times
+ROLLING_WINDOW = 3
+ROLLING_PASSES = 11
+
+
+# Weights of a centered rolling mean applied a number of times, as one kernel
+def rolling_kernel(window=ROLLING_WINDOW, passes=ROLLING_PASSES):
+    kernel = np.ones(1)
+    box = np.ones(window) / window
+    for _ in range(passes):
+        kernel = np.convolve(kernel, box)
+    return kernel
+
+# Normalized Gaussian weights, cut off at truncate standard deviations
+def gaussian_kernel(sigma=2.0, truncate=4.0):
+    half = max(int(truncate * sigma + 0.5), 1)
+    x = np.arange(-half, half + 1)
+    kernel = np.exp(-0.5 * (x / sigma) ** 2)
+    return kernel / kernel.sum()
+
+# Apply a centered kernel along the first axis in a single pass.
+# Like rolling().mean() the result is NaN where the window is not complete or
+# contains a missing or infinite value.
+def convolve_columns(values, kernel):
+    values = np.asarray(values, dtype=np.float64)
+    width = len(kernel)
+    half = width // 2
+    result = np.full(values.shape, np.nan)
+    if len(values) < width:
+        return result
+
+    finite = np.isfinite(values)
+    windows = sliding_window_view(np.where(finite, values, 0.0), width, axis=0)
+    smoothed = windows @ kernel[::-1]
+    smoothed[sliding_window_view(~finite, width, axis=0).any(axis=-1)] = np.nan
+    result[half:len(values) - half] = smoothed
+    return result
+
+# Exponentially weighted moving average along the first axis, restarted for every group
+def ewma_columns(values, span=7.0, group_ids=None):
+    frame = pd.DataFrame(np.asarray(values, dtype=np.float64).reshape(len(values), -1))
+    if group_ids is None:
+        smoothed = frame.ewm(span=span).mean()
+    else:
+        smoothed = frame.groupby(np.asarray(group_ids)).ewm(span=span).mean().reset_index(level=0, drop=True).sort_index()
+    return smoothed.to_numpy().reshape(np.shape(values))
+
+# Smooth every column of a 1D or 2D array (rows are days) with one of the kernels:
+# "rolling" (the same as the repeated rolling mean), "gaussian" or "ewma".
+# With group_starts the rows are several countries stacked on top of each other,
+# and no window crosses from one country into the next.
+def smooth(values, method="rolling", group_starts=None, window=ROLLING_WINDOW, passes=ROLLING_PASSES, sigma=2.0, span=7.0):
+    values = np.asarray(values, dtype=np.float64)
+    group_ids = None
+    if group_starts is not None:
+        is_start = np.zeros(len(values), dtype=bool)
+        is_start[np.asarray(group_starts, dtype=np.int64)] = True
+        group_ids = np.cumsum(is_start)
+
+    if method == "ewma":
+        return ewma_columns(values, span=span, group_ids=group_ids)
+    if method == "rolling":
+        kernel = rolling_kernel(window, passes)
+    elif method == "gaussian":
+        kernel = gaussian_kernel(sigma)
+    else:
+        raise ValueError(f"Unknown smoothing method: {method}")
+
+    result = convolve_columns(values, kernel)
+
+    # Blank out the edges of every group, where the window would reach into a neighbour
+    if group_ids is not None and len(values):
+        half = len(kernel) // 2
+        positions = np.arange(len(values))
+        starts = np.flatnonzero(np.r_[True, group_ids[1:] != group_ids[:-1]])
+        stops = np.r_[starts[1:], len(values)]
+        lengths = stops - starts
+        offset = positions - np.repeat(starts, lengths)
+        edge = (offset < half) | (offset >= np.repeat(lengths, lengths) - half)
+        result[edge] = np.nan
+    return result
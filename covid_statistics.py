@@ -1,21 +1,52 @@
-import sqlite3
+import os
 import pandas as pd
-import plotly.express as px
-import matplotlib.pyplot as plt
 import numpy as np
+from covid_lazy import lazy_import
+from covid_panel import get_panel
+from covid_cache import LRUCache
+from covid_db import read_sql, get_database_version
+from covid_daywise import get_date_range_engine
+from covid_cube import get_cube
+from covid_downsample import AUTO_THRESHOLD, downsample, downsample_frame
+from covid_trace import traced
+
+# matplotlib and plotly are only imported when the first plot is made
+px = lazy_import("plotly.express")
+plt = lazy_import("matplotlib.pyplot")
 
 db_path = "covid_database.db"
 csv_path = "cleaned_complete.csv" 
-df = pd.read_csv(csv_path, parse_dates=["Date"])
 
-# Create and return a new database connection
-def get_db_connection():
-    return sqlite3.connect(db_path, check_same_thread=False)
+# Finished figures that are reused on every rerun of the dashboard
+figure_cache = LRUCache(maxsize=32, name="figure_cache")
 
-# Create continent map
+# Build all continent maps when the dashboard starts, turn it off with COVID_WARM_UP=0
+# to save the time on a cold start. The maps are then built when they are first selected.
+warm_up = os.environ.get("COVID_WARM_UP", "1") not in ("", "0")
+
+# Every option of the continent selectbox
+CONTINENTS = ["All", "Asia", "Europe", "Africa", "North America", "South America", "Australia/Oceania"]
+
+# Keep covid_statistics.df working, it loads the panel on first access
+def __getattr__(name):
+    if name == "df":
+        return get_panel().df
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Create continent map, the figure is built once per version of the database
+@traced("plot")
 def plot_continent_map(continent):
-    connection = get_db_connection()
-    
+    return figure_cache.get_or_compute(("continent_map", continent, get_database_version()), lambda: build_continent_map(continent))
+
+# Build the maps of all continents, so switching continents never has to wait
+@traced("plot")
+def warm_continent_maps():
+    for continent in CONTINENTS:
+        plot_continent_map(continent)
+
+# Create continent map without the cache
+@traced("plot")
+def build_continent_map(continent):
     if continent == "All":
         query = """
             SELECT "Country.Region" AS "Country", TotalCases AS "Total Cases", Population
@@ -29,10 +60,8 @@ def plot_continent_map(continent):
             WHERE continent = ?
         """
     
-    df_continent_map = pd.read_sql(query, connection, params=(continent,) if continent != "All" else None)
+    df_continent_map = read_sql(query, params=(continent,) if continent != "All" else None)
     df_continent_map["Log Total Cases"] = np.log1p(df_continent_map["Total Cases"])
-
-    connection.close()  
     
     fig = px.choropleth(
         df_continent_map, 
@@ -88,17 +117,21 @@ def plot_continent_map(continent):
 
     return fig
 
-# Compare deathrate per continent
+# Compare deathrate per continent, the figure is built once per version of the database
+@traced("plot")
 def compare_death_rates():
-    connection = get_db_connection()
+    return figure_cache.get_or_compute(("death_rates", get_database_version()), build_death_rates)
+
+# Compare deathrate per continent without the cache
+@traced("plot")
+def build_death_rates():
     query = """
         SELECT Continent, SUM(TotalDeaths) AS Deaths, SUM(Population) AS Population
         FROM worldometer_data
         WHERE Continent IS NOT NULL
         GROUP BY Continent
     """
-    df = pd.read_sql(query, connection)
-    connection.close()
+    df = read_sql(query)
     
     df["DeathRate"] = df["Deaths"] / df["Population"]
     df["DeathRate"] *= 100  
@@ -121,9 +154,40 @@ def compare_death_rates():
 
     return fig
 
+# Labels of the region levels of the aggregation cube
+REGION_LEVELS = {"WHO Region": "who_region", "Continent": "continent"}
+
+# Regions of a level of the cube, e.g. get_regions("WHO Region")
+@traced("data")
+def get_regions(level):
+    return list(get_cube().keys[REGION_LEVELS[level]])
+
+# Plot the cases, deaths, recoveries and active cases of a WHO region or continent over time.
+# The series is a slice of the aggregation cube, the figure is cached per version of the cube.
+@traced("plot")
+def plot_region_series(level, region):
+    cube = get_cube()
+    return figure_cache.get_or_compute(("region_series", level, region, cube.version), lambda: build_region_series(cube, level, region))
+
+# Plot the series of a region without the cache
+@traced("plot")
+def build_region_series(cube, level, region):
+    df = cube.get_frame(REGION_LEVELS[level], region)
+    df_lines = downsample_frame(df, "Date", ["Confirmed", "Deaths", "Recovered", "Active"])
+    fig = px.line(
+        df_lines,
+        x="Date",
+        y="value",
+        color="variable",
+        title=f"COVID-19 in {region}",
+        labels={"value": "Count", "variable": ""},
+    )
+    fig.update_layout(hovermode="x unified")
+    return fig
+
 # Find the countries with the most cases
+@traced("data")
 def top_countries_by_cases():
-    connection = get_db_connection()
     query = """
         SELECT "Country.Region" AS Countries, ((TotalCases * 1.0 / Population) * 100) AS "Total Cases"
         FROM worldometer_data
@@ -131,8 +195,7 @@ def top_countries_by_cases():
         ORDER BY "Total Cases" DESC
         LIMIT 10
     """
-    df_cases = pd.read_sql(query, connection) 
-    connection.close()
+    df_cases = read_sql(query) 
 
     df_cases["Total Cases"] = df_cases["Total Cases"].map(lambda x: f"{x:.2f}%")
     
@@ -140,8 +203,8 @@ def top_countries_by_cases():
 
 
 # Find the countries with the highest deathrate
+@traced("data")
 def top_countries_by_deathrate():
-    connection = get_db_connection()
     query = """
         SELECT "Country.Region" AS Countries, ("Deaths.1M.pop" / 10000) AS "Death Rate"
         FROM worldometer_data
@@ -149,90 +212,83 @@ def top_countries_by_deathrate():
         ORDER BY "Death Rate" DESC
         LIMIT 10
     """
-    df_deaths = pd.read_sql(query, connection)
-    connection.close()
+    df_deaths = read_sql(query)
 
     df_deaths["Death Rate"] = df_deaths["Death Rate"].map(lambda x: f"{x:.2f}%")
 
     return df_deaths
 
+# Get the rows of day_wise for the selected dates, both the totals and the plotted series come from it
+@traced("data")
+def get_date_range(start_date, end_date):
+    return get_date_range_engine().query(start_date, end_date)
+
 # Get the total values for selected date
+@traced("data")
 def get_totals(start_date, end_date):
-    connection = get_db_connection()
-    
-    query = f"""
-        SELECT Date, Active, Deaths, Recovered, Confirmed
-        FROM day_wise 
-        WHERE Date BETWEEN '{start_date}' AND '{end_date}' 
-        ORDER BY Date DESC LIMIT 1;
-    """
-    
-    latest_row = pd.read_sql(query, connection)
-    connection.close()
-    
-    if not latest_row.empty:
-        total_active = latest_row['Active'].values[0]
-        total_deaths = latest_row['Deaths'].values[0]
-        total_recovered = latest_row['Recovered'].values[0]
-        total_confirmed = latest_row['Confirmed'].values[0]
-    else:
-        total_active = total_deaths = total_recovered = total_confirmed = 0
+    total_active, total_deaths, total_recovered, total_confirmed = get_date_range(start_date, end_date).get_totals()
     
     return total_active, total_deaths, total_recovered, total_confirmed
 
 # Plot the totals for a selected date
+@traced("plot")
 def plot_totals(start_date, end_date):
-    connection = get_db_connection()
-    
-    query = f"""
-        SELECT Date, Active, Deaths, Recovered 
-        FROM day_wise 
-        WHERE Date BETWEEN '{start_date}' AND '{end_date}' 
-        ORDER BY Date;
-    """
-    
-    filtered_data = pd.read_sql(query, connection)
-    connection.close()
+    filtered_data = get_date_range(start_date, end_date)
+    dates = filtered_data['Date']
+
+    # Long ranges are drawn from the points LTTB keeps, on a date axis so the lines stay in order
+    x = pd.to_datetime(dates) if len(dates) > AUTO_THRESHOLD else dates
+    active, deaths, recovered = downsample(x, [filtered_data['Active'], filtered_data['Deaths'], filtered_data['Recovered']])
     
     plt.figure(figsize=(12, 4))
-    plt.plot(filtered_data['Date'], filtered_data['Active'], label='Active Cases', color='blue')
-    plt.plot(filtered_data['Date'], filtered_data['Deaths'], label='Deaths', color='red')
-    plt.plot(filtered_data['Date'], filtered_data['Recovered'], label='Recovered', color='green')
+    plt.plot(*active, label='Active Cases', color='blue')
+    plt.plot(*deaths, label='Deaths', color='red')
+    plt.plot(*recovered, label='Recovered', color='green')
     plt.xlabel('Date')
     plt.ylabel('Count')
     plt.title('COVID-19 Trends')
     plt.xticks(rotation=45)
-    plt.xticks([filtered_data['Date'].iloc[0], filtered_data['Date'].iloc[-1]])
+    plt.xticks([active[0][0], active[0][-1]], [dates[0], dates[-1]])
     plt.legend()
     return plt
 
-# Creates an animated world map showing when each country first reported COVID-19.
-def plot_covid_spread_animation():
-    # Keep necessary columns
-    df_filtered = df[["Country.Region", "Date", "Confirmed"]].copy()
-
-    # Convert Confirmed cases to a binary indicator (1 if cases > 0, else 0)
-    df_filtered["Had COVID"] = df_filtered["Confirmed"] > 0
-
-    # Sort by date and keep only the first date when a country had a confirmed case
-    df_first_case = df_filtered[df_filtered["Had COVID"]].groupby("Country.Region", as_index=False)["Date"].min()
+# Build the animation table: for every date up to end_date, one row per country that had its first case by then
+@traced("data")
+def build_spread_frames(df, end_date="2020-05-20"):
+    # Keep only the first date when a country had a confirmed case
+    df_first_case = df[df["Confirmed"] > 0].groupby("Country.Region", as_index=False)["Date"].min()
 
     # Format the date as a string 
     df_first_case["First Case Date"] = df_first_case["Date"].dt.strftime('%Y-%m-%d')
 
     # Create a column to use for animation
-    all_dates = df_filtered["Date"].dt.strftime('%Y-%m-%d').unique()
-    all_dates = [date for date in all_dates if date <= "2020-05-20"] # Stops at 20th of May because every country has had a Covid cases at that point
-
-    df_expanded = pd.DataFrame()
-    for date in all_dates:
-        temp = df_first_case[df_first_case["Date"].dt.strftime('%Y-%m-%d') <= date].copy()
-        temp["Animation Date"] = date
-        temp["Had COVID"] = 1 
-        df_expanded = pd.concat([df_expanded, temp])
-
-    # Ensure "Had COVID" is actually present in df_expanded
-    df_expanded = df_expanded[["Country.Region", "Animation Date", "Had COVID", "First Case Date"]]
+    all_dates = np.sort(df["Date"].unique())
+    if end_date is not None:
+        all_dates = all_dates[all_dates <= np.datetime64(end_date)]
+
+    # Cross join of dates and countries, keeping the pairs where the first case was on or before the date
+    had_covid = df_first_case["Date"].to_numpy()[np.newaxis, :] <= all_dates[:, np.newaxis]
+    date_index, country_index = np.nonzero(had_covid)
+
+    return pd.DataFrame({
+        "Country.Region": df_first_case["Country.Region"].to_numpy()[country_index],
+        "Animation Date": pd.DatetimeIndex(all_dates).strftime('%Y-%m-%d').to_numpy()[date_index],
+        "Had COVID": 1,
+        "First Case Date": df_first_case["First Case Date"].to_numpy()[country_index],
+    })
+
+# Creates an animated world map showing when each country first reported COVID-19.
+# Stops at 20th of May by default because every country has had a Covid cases at that point,
+# pass end_date=None for the full timeline. The figure is cached per version of the data.
+@traced("plot")
+def plot_covid_spread_animation(end_date="2020-05-20"):
+    panel = get_panel()
+    return figure_cache.get_or_compute(("spread_animation", end_date, panel.version), lambda: build_spread_animation(panel.df, end_date))
+
+# Creates the animated world map without the cache
+@traced("plot")
+def build_spread_animation(df, end_date="2020-05-20"):
+    df_expanded = build_spread_frames(df, end_date)
 
     fig = px.choropleth(
         df_expanded,
@@ -1,27 +1,27 @@
-import sqlite3
 import pandas as pd
-import matplotlib.pyplot as plt
-import plotly.express as px
+from covid_lazy import lazy_import
+from covid_db import read_sql
+from covid_downsample import downsample_frame
+from covid_trace import traced
+
+# matplotlib and plotly are only imported when the first plot is made
+plt = lazy_import("matplotlib.pyplot")
+px = lazy_import("plotly.express")
 
 # Connect to the database
 db_path = "covid_database.db"
 
 
 # Finds the most recent date available in the dataset.
+@traced("data")
 def get_latest_date():
-    connection = sqlite3.connect(db_path)
     query = "SELECT MAX(Date) FROM usa_county_wise"
-    latest_date = pd.read_sql(query, connection).iloc[0, 0]
-    connection.close()
+    latest_date = read_sql(query).iloc[0, 0]
     return latest_date
 
-#  Fetches the top 5 counties in the U.S. based on the given column (Confirmed or Deaths),
-#    only for the most recent available date.
-def get_top_x_data(column_name):
-    connection = sqlite3.connect(db_path)
-    latest_date = get_latest_date()  
-    
-    query = f"""
+# One fixed statement per column, so the prepared statement can be reused
+top_x_queries = {
+    column_name: f"""
         SELECT 
             Province_State, 
             Admin2,
@@ -30,17 +30,47 @@ def get_top_x_data(column_name):
             SUM({column_name}) AS Total
         FROM usa_county_wise
         WHERE Country_Region = 'US' 
-        AND Date = '{latest_date}'  -- Filter for the latest date
+        AND Date = ?  -- Filter for the latest date
         GROUP BY Province_State, Admin2
         ORDER BY Total DESC
         LIMIT 10
     """
-    df = pd.read_sql(query, connection)
+    for column_name in ["Confirmed", "Deaths"]
+}
+
+# The same top 10 from the snapshot table made by database_migrations.py, an index lookup
+top_x_snapshot_queries = {
+    column_name: f"""
+        SELECT Province_State, Admin2, Lat, Long_, {column_name} AS Total
+        FROM usa_county_latest
+        WHERE Date = ?
+        ORDER BY {column_name} DESC
+        LIMIT 10
+    """
+    for column_name in ["Confirmed", "Deaths"]
+}
+
+# Checks if the snapshot tables of database_migrations.py exist
+@traced("data")
+def has_usa_snapshots():
+    query = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN ('usa_county_latest', 'usa_state_latest')"
+    return read_sql(query).iloc[0, 0] == 2
+
+#  Fetches the top 5 counties in the U.S. based on the given column (Confirmed or Deaths),
+#    only for the most recent available date.
+@traced("data")
+def get_top_x_data(column_name):
+    latest_date = get_latest_date()  
+    
+    # Use the snapshot when it is there and up to date, otherwise group the full table
+    df = read_sql(top_x_snapshot_queries[column_name], params=(latest_date,)) if has_usa_snapshots() else pd.DataFrame()
+    if df.empty:
+        df = read_sql(top_x_queries[column_name], params=(latest_date,))
     df['Category'] = 'Confirmed' if column_name == 'Confirmed' else 'Deaths'
-    connection.close()
     return df
 
 # create US map 
+@traced("plot")
 def create_map(dataframe, category):
     color_map = {'Confirmed': 'red', 'Deaths': 'blue'}
     
@@ -73,11 +103,13 @@ def create_map(dataframe, category):
     return fig
 
 # Create map with confirmed cases per state
+@traced("plot")
 def plot_confirmed_cases_map():
     top_x_confirmed = get_top_x_data('Confirmed')
     return create_map(top_x_confirmed, 'Confirmed')
 
 # Create map with deaths per state
+@traced("plot")
 def plot_deaths_map():
     top_x_deaths = get_top_x_data('Deaths')
     return create_map(top_x_deaths, 'Deaths')
@@ -96,23 +128,39 @@ STATE_ABBREVIATIONS = {
     "Virginia": "VA", "Washington": "WA", "West Virginia": "WV", "Wisconsin": "WI", "Wyoming": "WY"
 }
 
+# Territories that are not shown on the map of the states
+excluded_territories = "('American Samoa', 'Guam', 'Northern Mariana Islands', 'Puerto Rico', 'Virgin Islands')"
+
+# Confirmed cases per state on the latest date, from the full table
+state_query = f"""
+    SELECT 
+        Province_State AS State, 
+        SUM(Confirmed) AS "Total Confirmed"
+    FROM usa_county_wise
+    WHERE Country_Region = 'US' 
+    AND Date = ?  -- Filter for the latest date
+    AND Province_State NOT IN {excluded_territories}
+    GROUP BY Province_State
+"""
+
+# The same from the state rollup made by database_migrations.py
+state_snapshot_query = f"""
+    SELECT Province_State AS State, Confirmed AS "Total Confirmed"
+    FROM usa_state_latest
+    WHERE Date = ?
+    AND Province_State NOT IN {excluded_territories}
+    ORDER BY Province_State
+"""
+
 # Creates a choropleth map of confirmed COVID-19 cases by state
+@traced("plot")
 def plot_usa_choropleth():
-    connection = sqlite3.connect(db_path)
     latest_date = get_latest_date()  
     
-    query = f"""
-        SELECT 
-            Province_State AS State, 
-            SUM(Confirmed) AS "Total Confirmed"
-        FROM usa_county_wise
-        WHERE Country_Region = 'US' 
-        AND Date = '{latest_date}'  -- Filter for the latest date
-        AND Province_State NOT IN ('American Samoa', 'Guam', 'Northern Mariana Islands', 'Puerto Rico', 'Virgin Islands')
-        GROUP BY Province_State
-    """
-    df = pd.read_sql(query, connection)
-    connection.close()
+    # Use the state rollup when it is there and up to date, otherwise group the full table
+    df = read_sql(state_snapshot_query, params=(latest_date,)) if has_usa_snapshots() else pd.DataFrame()
+    if df.empty:
+        df = read_sql(state_query, params=(latest_date,))
     
     # Create a new "Abbreviation" column, instead of overwriting "State"
     df["Abbreviation"] = df["State"].map(STATE_ABBREVIATIONS)
@@ -147,4 +195,162 @@ def plot_usa_choropleth():
         )
     )
 
-    return fig
\ No newline at end of file
+    return fig
+
+# Checks if the rollup tables of database_migrations.py exist
+@traced("data")
+def has_usa_rollups():
+    query = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN ('usa_county_daily', 'usa_state_daily', 'usa_national_daily')"
+    return read_sql(query).iloc[0, 0] == 3
+
+# Time series per county, state and the whole country: the first query reads the rollup tables
+# made by database_migrations.py with an index lookup, the second groups the full table
+series_queries = {
+    "county": (
+        """
+        SELECT Date, Confirmed, Deaths
+        FROM usa_county_daily
+        WHERE Province_State = ? AND Admin2 = ?
+        ORDER BY Date
+        """,
+        """
+        SELECT Date, SUM(Confirmed) AS Confirmed, SUM(Deaths) AS Deaths
+        FROM usa_county_wise
+        WHERE Country_Region = 'US' AND Province_State = ? AND Admin2 = ?
+        GROUP BY Date
+        ORDER BY Date
+        """,
+    ),
+    "state": (
+        """
+        SELECT Date, Confirmed, Deaths
+        FROM usa_state_daily
+        WHERE Province_State = ?
+        ORDER BY Date
+        """,
+        """
+        SELECT Date, SUM(Confirmed) AS Confirmed, SUM(Deaths) AS Deaths
+        FROM usa_county_wise
+        WHERE Country_Region = 'US' AND Province_State = ?
+        GROUP BY Date
+        ORDER BY Date
+        """,
+    ),
+    "national": (
+        """
+        SELECT Date, Confirmed, Deaths
+        FROM usa_national_daily
+        ORDER BY Date
+        """,
+        """
+        SELECT Date, SUM(Confirmed) AS Confirmed, SUM(Deaths) AS Deaths
+        FROM usa_county_wise
+        WHERE Country_Region = 'US'
+        GROUP BY Date
+        ORDER BY Date
+        """,
+    ),
+}
+
+# Top counties on a date, from the rollup and from the full table
+top_counties_queries = {
+    column_name: (
+        f"""
+        SELECT Province_State, Admin2, Lat, Long_, {column_name} AS Total
+        FROM usa_county_daily
+        WHERE Date = ?
+        ORDER BY {column_name} DESC
+        LIMIT ?
+        """,
+        f"""
+        SELECT Province_State, Admin2, Lat, Long_, SUM({column_name}) AS Total
+        FROM usa_county_wise
+        WHERE Country_Region = 'US' AND Date = ?
+        GROUP BY Province_State, Admin2
+        ORDER BY Total DESC
+        LIMIT ?
+        """,
+    )
+    for column_name in ["Confirmed", "Deaths"]
+}
+
+# Run the rollup query when the rollup tables exist, otherwise the query on the full table
+def read_rollup(queries, params=()):
+    rollup_query, full_query = queries
+    return read_sql(rollup_query if has_usa_rollups() else full_query, params=params)
+
+# Confirmed cases and deaths per date of one county
+@traced("data")
+def county_series(state, county):
+    df = read_rollup(series_queries["county"], params=(state, county))
+    df["Date"] = pd.to_datetime(df["Date"])
+    return df
+
+# Confirmed cases and deaths per date of one state
+@traced("data")
+def state_series(state):
+    df = read_rollup(series_queries["state"], params=(state,))
+    df["Date"] = pd.to_datetime(df["Date"])
+    return df
+
+# Confirmed cases and deaths per date of the whole country
+@traced("data")
+def national_series():
+    df = read_rollup(series_queries["national"])
+    df["Date"] = pd.to_datetime(df["Date"])
+    return df
+
+# The n counties with the most confirmed cases or deaths on a date, the latest date by default
+@traced("data")
+def top_counties(date=None, column_name="Confirmed", n=10):
+    if date is None:
+        date = get_latest_date()
+    # Dates are stored as 'YYYY-MM-DD' text, str() of a Timestamp or datetime would add the time
+    date = pd.Timestamp(date).strftime("%Y-%m-%d")
+    df = read_rollup(top_counties_queries[column_name], params=(date, n))
+    df["Category"] = column_name
+    return df
+
+# States in the USA data, alphabetically
+@traced("data")
+def get_usa_states():
+    if has_usa_rollups():
+        query = "SELECT DISTINCT Province_State FROM usa_state_daily ORDER BY Province_State"
+    else:
+        query = "SELECT DISTINCT Province_State FROM usa_county_wise WHERE Country_Region = 'US' ORDER BY Province_State"
+    return read_sql(query)["Province_State"].dropna().tolist()
+
+# Counties of a state, alphabetically
+@traced("data")
+def get_usa_counties(state):
+    if has_usa_rollups():
+        query = "SELECT DISTINCT Admin2 FROM usa_county_daily WHERE Province_State = ? ORDER BY Admin2"
+    else:
+        query = "SELECT DISTINCT Admin2 FROM usa_county_wise WHERE Country_Region = 'US' AND Province_State = ? ORDER BY Admin2"
+    return read_sql(query, params=(state,))["Admin2"].dropna().tolist()
+
+# Line chart of confirmed cases and deaths over time for a county, a state or the whole country
+@traced("plot")
+def plot_usa_time_series(state=None, county=None):
+    if state is not None and county is not None:
+        df = county_series(state, county)
+        place = f"{county}, {state}"
+    elif state is not None:
+        df = state_series(state)
+        place = state
+    else:
+        df = national_series()
+        place = "the USA"
+
+    # Long series are drawn from the points LTTB keeps, so the browser gets fewer points
+    df_lines = downsample_frame(df, "Date", ["Confirmed", "Deaths"])
+
+    fig = px.line(
+        df_lines,
+        x="Date",
+        y="value",
+        color="variable",
+        title=f"Confirmed COVID-19 Cases and Deaths in {place}",
+    )
+    fig.update_layout(yaxis=dict(title="People", tickformat=","), legend_title_text="")
+    return fig
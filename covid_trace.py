@@ -0,0 +1,132 @@
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import pandas as pd
+
+# Tracing is off unless COVID_TRACE=1 is set or enable() is called.
+# When it is off every traced function only checks this flag.
+enabled = os.environ.get("COVID_TRACE", "0") not in ("", "0")
+
+_local = threading.local()
+
+
+# Timed events of one rerun of the dashboard, recorded by the thread that runs it
+class Trace:
+    def __init__(self, name="rerun"):
+        self.name = name
+        self.pid = os.getpid()
+        self.tid = threading.get_ident()
+        self.start = time.perf_counter()
+        self.depth = 0
+        self.events = []
+
+    # Add an event that started at start (perf_counter seconds) and took seconds
+    def add(self, kind, name, start, seconds, **details):
+        self.events.append({
+            "kind": kind,
+            "name": name,
+            "start": start - self.start,
+            "seconds": seconds,
+            "depth": self.depth,
+            **details,
+        })
+
+    # Seconds since the trace started
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    # Calls, total and slowest time per event, slowest in total first
+    def summary(self):
+        df = pd.DataFrame(self.events, columns=["kind", "name", "seconds"])
+        df = df.groupby(["kind", "name"], as_index=False)["seconds"].agg(calls="count", total_seconds="sum", max_seconds="max")
+        return df.sort_values("total_seconds", ascending=False).reset_index(drop=True)
+
+    def to_json(self):
+        return json.dumps({"name": self.name, "seconds": self.elapsed(), "events": self.events}, default=str, indent=2)
+
+    # Chrome trace format, open it in chrome://tracing or https://ui.perfetto.dev
+    def to_chrome_trace(self):
+        events = []
+        for event in self.events:
+            details = {key: value for key, value in event.items() if key not in ("kind", "name", "start", "seconds", "depth")}
+            events.append({
+                "name": event["name"],
+                "cat": event["kind"],
+                "ph": "X",
+                "ts": event["start"] * 1e6,
+                "dur": event["seconds"] * 1e6,
+                "pid": self.pid,
+                "tid": self.tid,
+                "args": details,
+            })
+        return json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}, default=str)
+
+
+def enable():
+    global enabled
+    enabled = True
+
+def disable():
+    global enabled
+    enabled = False
+    _local.trace = None
+
+def is_enabled():
+    return enabled
+
+# Start a new trace for the current thread, events of the previous rerun are dropped
+def start_trace(name="rerun"):
+    _local.trace = Trace(name)
+    return _local.trace
+
+# Trace of the current thread, None when tracing is off or no trace was started
+def get_trace():
+    if not enabled:
+        return None
+    return getattr(_local, "trace", None)
+
+# Add an event that just finished, used for SQL queries and cache lookups
+def record(kind, name, seconds=0.0, **details):
+    trace = get_trace()
+    if trace is not None:
+        trace.add(kind, name, time.perf_counter() - seconds, seconds, **details)
+
+# Time a block of code as one event
+@contextlib.contextmanager
+def span(kind, name, **details):
+    trace = get_trace()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    trace.depth += 1
+    try:
+        yield
+    finally:
+        trace.depth -= 1
+        trace.add(kind, name, start, time.perf_counter() - start, **details)
+
+# Decorator that times every call of a function as an event of the given kind
+def traced(kind="function"):
+    def decorator(function):
+        name = f"{function.__module__}.{function.__name__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            trace = getattr(_local, "trace", None)
+            if trace is None:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            trace.depth += 1
+            try:
+                return function(*args, **kwargs)
+            finally:
+                trace.depth -= 1
+                trace.add(kind, name, start, time.perf_counter() - start)
+        return wrapper
+    return decorator
@@ -1,33 +1,26 @@
-import sqlite3
+import argparse
+import csv
+import json
+import os
+import sys
+import tracemalloc
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import plotly.express as px
+from covid_panel import get_cache_dir, read_cleaned_complete
+from covid_schema import NULLABLE_COLUMNS, cast_counts
 
-# Load the CSV file
-file_path = "cleaned_complete.csv"  
-df = pd.read_csv(file_path)
+# Cleaned data and the raw feed new days come from
+file_path = "cleaned_complete.csv"
+raw_path = "complete.csv"
 
-# Remove duplicates 
-before_count = df.shape[0]
-df_cleaned = df.drop_duplicates(keep="first")
-after_count = df_cleaned.shape[0]
+# File in the cache folder of the CSV (.cleaned_complete.cache) with the last ingested date
+watermark_name = "watermark.json"
 
 # List of countries to merge provinces into a single entry
 countries_to_merge = ["China", "Canada", "Australia", "Faroe Islands"]
 
-# Separate data
-df_merge = df_cleaned[df_cleaned["Country.Region"].isin(countries_to_merge)]
-df_other = df_cleaned[~df_cleaned["Country.Region"].isin(countries_to_merge)]
-
-# Group by Country and Date to merge provinces per date entry
-df_merged = df_merge.groupby(["Country.Region", "Date"], as_index=False).agg({
-    "Confirmed": "sum",
-    "Deaths": "sum",
-    "Recovered": "sum",
-    "Active": "sum",
-    "WHO.Region": "first"  
-})
-
 # Set fixed Lat/Long for merged countries
 central_coords = {
     "China": (35.8617, 104.1954),
@@ -36,9 +29,6 @@ central_coords = {
     "Faroe Islands": (61.8926, -6.9118)
 }
 
-df_merged["Lat"] = df_merged["Country.Region"].map(lambda x: central_coords[x][0])
-df_merged["Long"] = df_merged["Country.Region"].map(lambda x: central_coords[x][1])
-
 # Define territories to merge
 territory_mapping = {
     "UK Overseas Territories": ["Bermuda", "Gibraltar", "Falkland Islands (Malvinas)", "Montserrat", "Turks and Caicos Islands", "Cayman Islands", "British Virgin Islands", "Anguilla", "Isle of Man", "Channel Islands"],
@@ -53,43 +43,355 @@ territory_coords = {
     "Caribbean Netherlands": (12.1784, -68.2385)
 }
 
-# Separate data for territories
-df_other = df_other[~df_other["Province.State"].isin(sum(territory_mapping.values(), []))]
-df_merged_list = []
+# Territory to the region it is merged into
+territory_regions = {territory: region for region, territories in territory_mapping.items() for territory in territories}
+
+
+# Remove duplicates and merge provinces and territories, the same rules for a full run and for new days
+def clean_data(df):
+    # Work on plain columns, with categories every group by and map would work per category
+    df = df.astype({column: object for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)})
+    df_cleaned = df.drop_duplicates(keep="first")
+
+    # Separate data
+    df_merge = df_cleaned[df_cleaned["Country.Region"].isin(countries_to_merge)]
+    df_other = df_cleaned[~df_cleaned["Country.Region"].isin(countries_to_merge)]
 
-# Process each group of territories
-for new_region, territories in territory_mapping.items():
-    df_territories = df_cleaned[df_cleaned["Province.State"].isin(territories)]
-    df_grouped = df_territories.groupby(["Date"], as_index=False).agg({
+    # Group by Country and Date to merge provinces per date entry
+    df_merged = df_merge.groupby(["Country.Region", "Date"], as_index=False).agg({
         "Confirmed": "sum",
         "Deaths": "sum",
         "Recovered": "sum",
         "Active": "sum",
-        "WHO.Region": "first" 
+        "WHO.Region": "first"
     })
-    df_grouped["Country.Region"] = new_region
-    df_grouped["Province.State"] = 0
-    df_grouped["Lat"] = territory_coords[new_region][0]
-    df_grouped["Long"] = territory_coords[new_region][1]
-    df_merged_list.append(df_grouped)
 
-# Combine all data
-df_final = pd.concat([df_other, df_merged] + df_merged_list, ignore_index=True)
+    df_merged["Lat"] = df_merged["Country.Region"].map(lambda x: central_coords[x][0])
+    df_merged["Long"] = df_merged["Country.Region"].map(lambda x: central_coords[x][1])
+
+    # Separate data for territories
+    df_other = df_other[~df_other["Province.State"].isin(sum(territory_mapping.values(), []))]
+    df_merged_list = []
+
+    # Process each group of territories
+    for new_region, territories in territory_mapping.items():
+        df_territories = df_cleaned[df_cleaned["Province.State"].isin(territories)]
+        df_grouped = df_territories.groupby(["Date"], as_index=False).agg({
+            "Confirmed": "sum",
+            "Deaths": "sum",
+            "Recovered": "sum",
+            "Active": "sum",
+            "WHO.Region": "first"
+        })
+        df_grouped["Country.Region"] = new_region
+        df_grouped["Province.State"] = None
+        df_grouped["Lat"] = territory_coords[new_region][0]
+        df_grouped["Long"] = territory_coords[new_region][1]
+        df_merged_list.append(df_grouped)
+
+    # Combine all data
+    df_final = pd.concat([df_other, df_merged] + df_merged_list, ignore_index=True)
+
+    # Sort first by Date, then by Country.Region alphabetically
+    df_final = df_final.sort_values(by=["Date", "Country.Region"]).reset_index(drop=True)
+
+    # Replace missing values with 0, a missing province stays missing
+    return fill_missing(df_final)
+
+# Missing counts, coordinates and regions become 0, the counts integers
+def fill_missing(df):
+    df = df.fillna({column: 0 for column in df.columns if column not in NULLABLE_COLUMNS})
+    return cast_counts(df)
+
+# Last date in the cleaned CSV, read from its final line
+def read_last_date(path):
+    with open(path, "rb") as file:
+        header = next(csv.reader([file.readline().decode("utf-8")]))
+        file.seek(0, os.SEEK_END)
+        position = file.tell()
+
+        # Read backwards until a whole last line is in the buffer
+        block = b""
+        while position > 0 and block.strip().count(b"\n") < 1:
+            step = min(4096, position)
+            position -= step
+            file.seek(position)
+            block = file.read(step) + block
+
+    row = next(csv.reader([block.strip().split(b"\n")[-1].decode("utf-8")]))
+    if row == header:
+        return None
+    return pd.Timestamp(row[header.index("Date")])
+
+# Path of the watermark of a cleaned CSV
+def get_watermark_path(path=file_path):
+    return os.path.join(get_cache_dir(path), watermark_name)
+
+# The watermark is trusted while the CSV still has the size it had when the watermark was written,
+# otherwise it is taken from the last row of the CSV (e.g. after a full run or an interrupted append)
+def read_watermark(path=file_path, watermark=None):
+    watermark = watermark or get_watermark_path(path)
+    try:
+        with open(watermark) as file:
+            saved = json.load(file)
+        if saved["size"] == os.path.getsize(path):
+            return pd.Timestamp(saved["date"])
+    except (OSError, ValueError, KeyError):
+        pass
+    return read_last_date(path)
+
+# Save the last ingested date together with the size of the CSV
+def write_watermark(date, path=file_path, watermark=None):
+    watermark = watermark or get_watermark_path(path)
+    os.makedirs(os.path.dirname(watermark), exist_ok=True)
+    temporary = f"{watermark}.{os.getpid()}"
+    with open(temporary, "w") as file:
+        json.dump({"date": pd.Timestamp(date).strftime("%Y-%m-%d"), "size": os.path.getsize(path)}, file)
+    os.replace(temporary, watermark)
+
+# Clean the whole CSV again and rewrite it
+def run_full(path=file_path):
+    # Load the CSV file, through its binary cache
+    df = read_cleaned_complete(path)
+
+    # Remove duplicates
+    before_count = df.shape[0]
+    after_count = df.drop_duplicates(keep="first").shape[0]
+
+    df_final = clean_data(df)
+
+    # Save the cleaned DataFrame to a new CSV file
+    df_final.to_csv(path, index=False, date_format="%Y-%m-%d")
+    if not df_final.empty:
+        write_watermark(df_final["Date"].max(), path)
+
+    # Look for missing values
+    missing_values = df_final.isnull().sum()
+
+    # Print summary
+    print(f"Total Rows Before : {before_count}")
+    print(f"Total Rows After: {after_count}")
+    print(f"Duplicates removed: {before_count - after_count}")
+    print("Missing values per column:\n", missing_values)
+
+# Clean only the days of the raw feed after the watermark and append them to the CSV.
+# Days are ingested as a whole, running it again without new days does nothing.
+def run_incremental(raw=raw_path, path=file_path):
+    watermark = read_watermark(path)
+
+    # Only keep the rows of the raw feed after the watermark
+    chunks = []
+    for chunk in pd.read_csv(raw, parse_dates=["Date"], chunksize=100_000):
+        if watermark is not None:
+            chunk = chunk[chunk["Date"] > watermark]
+        if not chunk.empty:
+            chunks.append(chunk)
+    if not chunks:
+        print(f"No new days after {watermark:%Y-%m-%d}" if watermark is not None else "No rows in the raw feed")
+        return 0
+
+    df_new = clean_data(pd.concat(chunks, ignore_index=True))
+
+    # Append in the column order of the existing CSV
+    with open(path) as file:
+        columns = file.readline().strip().split(",")
+    df_new[columns].to_csv(path, mode="a", header=False, index=False, date_format="%Y-%m-%d")
+    write_watermark(df_new["Date"].max(), path)
+
+    print(f"Appended {len(df_new)} rows for {df_new['Date'].nunique()} new days, up to {df_new['Date'].max():%Y-%m-%d}")
+    return len(df_new)
+
+
+# Peak resident memory of this process in MB. resource only exists on POSIX, on Windows the peak
+# working set of psutil is used when it is installed, otherwise the peak of tracemalloc while it traces.
+# None when none of them is available.
+def get_peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            if tracemalloc.is_tracing():
+                return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            return None
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+# Resident memory of this process right now in MB: from /proc on Linux, from psutil when it is installed,
+# otherwise what tracemalloc counts while it traces. None when none of them is available.
+def get_current_rss_mb():
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        if tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[0] / (1024 * 1024)
+        return None
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+# Region a raw row is merged into, NaN for rows that are kept as they are
+def get_merge_labels(df):
+    labels = df["Country.Region"].where(df["Country.Region"].isin(countries_to_merge))
+    return labels.fillna(df["Province.State"].map(territory_regions))
+
+# Rows of one finished day: the kept rows plus one row per merged country or territory group
+def build_day(date, kept, groups, columns):
+    merged_rows = []
+    for region, (sums, who_region) in groups.items():
+        lat, long = central_coords[region] if region in central_coords else territory_coords[region]
+        merged_rows.append({
+            "Province.State": None,
+            "Country.Region": region,
+            "Lat": lat,
+            "Long": long,
+            "Date": date,
+            "Confirmed": sums[0],
+            "Deaths": sums[1],
+            "Recovered": sums[2],
+            "Active": sums[3],
+            "WHO.Region": who_region,
+        })
+    frames = kept + ([pd.DataFrame(merged_rows)] if merged_rows else [])
+    day = pd.concat(frames, ignore_index=True).reindex(columns=columns)
+    day = day.sort_values("Country.Region", kind="mergesort")
+    return fill_missing(day)
+
+# Clean a raw feed that is sorted by date in chunks, with the same rules as clean_data.
+# Only the rows of the day that is being read are kept in memory: duplicates are found with
+# row hashes of the open day, province and territory sums are added up per chunk and a day is
+# written as soon as the next day starts. The chunk size is chosen to stay below max_memory_mb, and a
+# warning is printed when the memory of the run still grew by more than that.
+def run_streaming(raw=raw_path, path=file_path, max_memory_mb=256, first_chunk_rows=10_000):
+    budget = max_memory_mb * 1024 * 1024
+
+    # Memory in use before reading the feed, e.g. by pandas itself or an earlier run in the same process,
+    # does not count against the budget. The growth is sampled after every chunk and every written day,
+    # the peak RSS of the process would hide it when the process was larger before.
+    start_mb = get_current_rss_mb()
+    tracing = start_mb is None
+    if tracing:
+        tracemalloc.start()
+        start_mb = 0.0
+    count_columns = ["Confirmed", "Deaths", "Recovered", "Active"]
+    reader = pd.read_csv(raw, parse_dates=["Date"], iterator=True)
+    columns = list(reader.get_chunk(0).columns)
+
+    # State of the day that is still being read
+    open_date = None
+    seen = set()
+    kept = []
+    groups = {}
+
+    stats = {"rows_read": 0, "duplicates": 0, "rows_written": 0, "days": 0, "chunks": 0, "data_mb": 0.0}
+
+    # Keep the largest growth of the memory since the start of the run
+    def sample_memory():
+        stats["data_mb"] = max(stats["data_mb"], get_current_rss_mb() - start_mb)
+    chunk_rows = first_chunk_rows
+    temporary = f"{path}.{os.getpid()}.tmp"
+
+    with open(temporary, "w", newline="") as output:
+        # Write the open day to the output and start a new one
+        def flush_day():
+            nonlocal seen, kept, groups
+            if open_date is None:
+                return
+            day = build_day(open_date, kept, groups, columns)
+            sample_memory()
+            day.to_csv(output, header=stats["days"] == 0, index=False, date_format="%Y-%m-%d")
+            stats["rows_written"] += len(day)
+            stats["days"] += 1
+            seen, kept, groups = set(), [], {}
+
+        while True:
+            try:
+                chunk = reader.get_chunk(chunk_rows)
+            except StopIteration:
+                break
+            stats["chunks"] += 1
+            stats["rows_read"] += len(chunk)
+            sample_memory()
+
+            # Pick the chunk size from the memory one row takes, a quarter of the budget per chunk
+            bytes_per_row = chunk.memory_usage(deep=True).sum() / max(len(chunk), 1)
+            chunk_rows = max(1_000, int(budget / 4 / bytes_per_row))
+
+            # Remove duplicates within the chunk and of rows seen earlier
+            hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+            is_new = ~pd.Series(hashes).duplicated().to_numpy() & np.array([value not in seen for value in hashes], dtype=bool)
+            stats["duplicates"] += int((~is_new).sum())
+            chunk = chunk[is_new]
+            hashes = hashes[is_new]
+            labels = get_merge_labels(chunk)
+
+            # Handle the chunk one day at a time, the feed is sorted by date
+            for date, rows in chunk.groupby("Date", sort=False).indices.items():
+                if open_date is not None and date < open_date:
+                    raise ValueError(f"The raw feed must be sorted by Date, {date:%Y-%m-%d} came after {open_date:%Y-%m-%d}")
+                if date != open_date:
+                    flush_day()
+                    open_date = date
+                seen.update(hashes[rows].tolist())
+
+                day_rows = chunk.iloc[rows]
+                day_labels = labels.iloc[rows]
+                kept.append(day_rows[day_labels.isna().to_numpy()])
+
+                # Add the sums of the merged rows to the groups of the day
+                to_merge = day_rows[day_labels.notna().to_numpy()]
+                if not to_merge.empty:
+                    sums = to_merge.groupby(day_labels[day_labels.notna()], sort=False).agg(
+                        {**{column: "sum" for column in count_columns}, "WHO.Region": "first"})
+                    for region, row in sums.iterrows():
+                        values = row[count_columns].to_numpy(dtype=np.float64)
+                        if region in groups:
+                            previous, who_region = groups[region]
+                            groups[region] = (previous + values, who_region if pd.notna(who_region) else row["WHO.Region"])
+                        else:
+                            groups[region] = (values, row["WHO.Region"])
+
+        flush_day()
 
-# Sort first by Date, then by Country.Region alphabetically
-df_final = df_final.sort_values(by=["Date", "Country.Region"]).reset_index(drop=True)
+    os.replace(temporary, path)
+    if stats["days"]:
+        write_watermark(open_date, path)
 
-# Replace missing values with 0
-df_final = df_final.fillna(0)
+    sample_memory()
+    if tracing:
+        # Between the samples the peak of tracemalloc is exact
+        stats["data_mb"] = max(stats["data_mb"], tracemalloc.get_traced_memory()[1] / (1024 * 1024))
+    stats["peak_rss_mb"] = get_peak_rss_mb()
+    if tracing:
+        tracemalloc.stop()
+    print(f"Read {stats['rows_read']} rows in {stats['chunks']} chunks, removed {stats['duplicates']} duplicates")
+    print(f"Wrote {stats['rows_written']} rows for {stats['days']} days to {path}")
+    print(f"Peak memory: {stats['peak_rss_mb']:.1f} MB, {stats['data_mb']:.1f} MB for the data (budget: {max_memory_mb} MB)")
+    if stats["data_mb"] > max_memory_mb:
+        print(f"Warning: the data took {stats['data_mb']:.1f} MB, more than the budget of {max_memory_mb} MB. "
+              "The budget sets the chunk size, a day of the feed is always kept in memory as a whole.", file=sys.stderr)
+    return stats
 
-# Save the cleaned DataFrame to a new CSV file
-df_final.to_csv("cleaned_complete.csv", index=False)
 
-# Look for missing values
-missing_values = df_final.isnull().sum()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clean the COVID-19 data in cleaned_complete.csv")
+    parser.add_argument("--incremental", action="store_true", help="only add the days of the raw feed after the watermark")
+    parser.add_argument("--stream", action="store_true", help="clean the whole raw feed in chunks with bounded memory")
+    parser.add_argument("--raw", default=raw_path, help="raw feed used by --incremental and --stream")
+    parser.add_argument("--max-memory-mb", type=float, default=256, help="memory budget for the data in --stream, sets the chunk size and warns when it is exceeded")
+    args = parser.parse_args()
 
-# Print summary
-print(f"Total Rows Before : {before_count}")
-print(f"Total Rows After: {after_count}")
-print(f"Duplicates removed: {before_count - after_count}")
-print("Missing values per column:\n", missing_values)
+    if args.stream:
+        run_streaming(args.raw, file_path, max_memory_mb=args.max_memory_mb)
+    elif args.incremental:
+        run_incremental(args.raw, file_path)
+    else:
+        run_full(file_path)
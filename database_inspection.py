@@ -1,21 +1,12 @@
-import pandas as pd
-import sqlite3 
-import numpy as np
+from covid_db import read_sql
 
 def getDataFrame(table):
-    connection = sqlite3.connect('covid_database.db')
-    cursor = connection.cursor()
-    
-    # SQL Query
+    # SQL Query, on the shared read-only connection
     query = f"SELECT * FROM {table}"  
-    cursor.execute(query)
-    rows = cursor.fetchall()  
+    df = read_sql(query, path='covid_database.db')
 
     # Get column names
-    column_names = [desc[0] for desc in cursor.description]
-
-    # Create DataFrame with correct column names
-    df = pd.DataFrame(rows, columns=column_names)
+    column_names = list(df.columns)
 
     return df, column_names  
 
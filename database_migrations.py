@@ -0,0 +1,113 @@
+import sqlite3
+
+# Connect to database
+db_path = "covid_database.db"
+
+# Version of the schema after all migrations, stored in PRAGMA user_version
+SCHEMA_VERSION = 1
+
+
+# Covering index for the USA tab: the latest date is read from the start of the index and
+# the rows of one date can be grouped by state and county without reading the table
+def create_usa_indexes(connection):
+    connection.execute("""
+        CREATE INDEX IF NOT EXISTS idx_usa_county_wise_date
+        ON usa_county_wise (Date, Country_Region, Province_State, Admin2, Confirmed, Deaths, Lat, Long_)
+    """)
+
+# Rebuild the snapshot of the latest date per county and the rollup per state.
+# Call this after new rows have been loaded into usa_county_wise.
+def refresh_usa_snapshots(connection):
+    with connection:
+        connection.execute("DROP TABLE IF EXISTS usa_county_latest")
+        connection.execute("""
+            CREATE TABLE usa_county_latest AS
+            SELECT
+                Date,
+                Province_State,
+                Admin2,
+                Lat,
+                Long_,
+                SUM(Confirmed) AS Confirmed,
+                SUM(Deaths) AS Deaths
+            FROM usa_county_wise
+            WHERE Country_Region = 'US'
+            AND Date = (SELECT MAX(Date) FROM usa_county_wise)
+            GROUP BY Province_State, Admin2
+        """)
+        connection.execute("CREATE INDEX idx_usa_county_latest_confirmed ON usa_county_latest (Date, Confirmed DESC)")
+        connection.execute("CREATE INDEX idx_usa_county_latest_deaths ON usa_county_latest (Date, Deaths DESC)")
+
+        connection.execute("DROP TABLE IF EXISTS usa_state_latest")
+        connection.execute("""
+            CREATE TABLE usa_state_latest AS
+            SELECT
+                Date,
+                Province_State,
+                SUM(Confirmed) AS Confirmed,
+                SUM(Deaths) AS Deaths
+            FROM usa_county_latest
+            GROUP BY Date, Province_State
+        """)
+        connection.execute("CREATE INDEX idx_usa_state_latest_date ON usa_state_latest (Date, Province_State)")
+
+# Rebuild the time series of the USA: every county, every state and the whole country per date.
+# Call this after new rows have been loaded into usa_county_wise.
+def refresh_usa_rollups(connection):
+    with connection:
+        connection.execute("DROP TABLE IF EXISTS usa_county_daily")
+        connection.execute("""
+            CREATE TABLE usa_county_daily AS
+            SELECT
+                Province_State,
+                Admin2,
+                Date,
+                MAX(Lat) AS Lat,
+                MAX(Long_) AS Long_,
+                SUM(Confirmed) AS Confirmed,
+                SUM(Deaths) AS Deaths
+            FROM usa_county_wise
+            WHERE Country_Region = 'US'
+            GROUP BY Province_State, Admin2, Date
+        """)
+        connection.execute("CREATE INDEX idx_usa_county_daily_county ON usa_county_daily (Province_State, Admin2, Date)")
+        connection.execute("CREATE INDEX idx_usa_county_daily_confirmed ON usa_county_daily (Date, Confirmed DESC)")
+        connection.execute("CREATE INDEX idx_usa_county_daily_deaths ON usa_county_daily (Date, Deaths DESC)")
+
+        connection.execute("DROP TABLE IF EXISTS usa_state_daily")
+        connection.execute("""
+            CREATE TABLE usa_state_daily AS
+            SELECT Province_State, Date, SUM(Confirmed) AS Confirmed, SUM(Deaths) AS Deaths
+            FROM usa_county_daily
+            GROUP BY Province_State, Date
+        """)
+        connection.execute("CREATE INDEX idx_usa_state_daily_state ON usa_state_daily (Province_State, Date)")
+
+        connection.execute("DROP TABLE IF EXISTS usa_national_daily")
+        connection.execute("""
+            CREATE TABLE usa_national_daily AS
+            SELECT Date, SUM(Confirmed) AS Confirmed, SUM(Deaths) AS Deaths
+            FROM usa_state_daily
+            GROUP BY Date
+        """)
+        connection.execute("CREATE INDEX idx_usa_national_daily_date ON usa_national_daily (Date)")
+
+# Bring the database up to SCHEMA_VERSION and refresh the snapshot and rollup tables
+def migrate(path=db_path):
+    connection = sqlite3.connect(path)
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+
+    if version < 1:
+        create_usa_indexes(connection)
+        connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        connection.commit()
+
+    refresh_usa_snapshots(connection)
+    refresh_usa_rollups(connection)
+    connection.execute("ANALYZE")
+    connection.commit()
+    connection.close()
+
+
+if __name__ == "__main__":
+    migrate()
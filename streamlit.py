@@ -1,31 +1,42 @@
-import sqlite3
 import pandas as pd
-import matplotlib.pyplot as plt
-import plotly.express as px
 import streamlit as st
 from covid_statistics_usa import *
 from covid_sird_model import *
 import covid_statistics as gs
 from covid_statistics import *
+from covid_render import render_sird_tab
+import covid_trace
 import streamlit as st
 from datetime import datetime
 
 
 st.set_page_config(page_title="COVID-19 Dashboard", layout="wide")
 
+# Time this rerun when tracing is on (COVID_TRACE=1), the timings are shown in the sidebar
+trace = covid_trace.start_trace() if covid_trace.is_enabled() else None
+
+# Build the continent maps once per server process, all sessions share them (unless COVID_WARM_UP=0)
+@st.cache_resource
+def warm_up_figures():
+    warm_continent_maps()
+    return True
+
+if gs.warm_up:
+    warm_up_figures()
+
 # Title
 st.title("COVID-19 Dashboard")
 
 # Create tabs
 tab1, tab2, tab3 = st.tabs(["Global Statistics", "SIRD Model", "USA Statistics"])
 
-with tab1:
+with tab1, covid_trace.span("tab", "Global Statistics"):
     # Sidebar 
     st.sidebar.header("Global Statistics")
     st.sidebar.subheader("Select Date Range")
     start_date = st.sidebar.date_input("Start Date", datetime(2020, 1, 22))
     end_date = st.sidebar.date_input("End Date", datetime(2020, 7, 27))
-    continent = st.sidebar.selectbox("Select Continent", ["All", "Asia", "Europe", "Africa", "North America", "South America", "Australia/Oceania"])
+    continent = st.sidebar.selectbox("Select Continent", CONTINENTS)
 
     # Convert selected dates to string format for SQL usage
     start_date = start_date.strftime('%Y-%m-%d')
@@ -61,6 +72,16 @@ with tab1:
 
     st.divider()
 
+    st.subheader("Cases per Region", help="Select a WHO region or a continent to see its cases, deaths and recoveries over time")
+    col5, col6 = st.columns([1, 1])
+    with col5:
+        region_level = st.selectbox("Region type", list(REGION_LEVELS))
+    with col6:
+        region = st.selectbox("Region", get_regions(region_level))
+    st.plotly_chart(plot_region_series(region_level, region), use_container_width=True)
+
+    st.divider()
+
     col3, col4 = st.columns(2)
 
     with col3:
@@ -71,7 +92,7 @@ with tab1:
         st.subheader("Highest Death Rate", help = "The death rate is calculated by divinding the number of deaths by the population" )
         st.dataframe(top_deaths_df, use_container_width=True, hide_index=True)
 
-with tab2:
+with tab2, covid_trace.span("tab", "SIRD Model"):
     st.title("SIRD Model", help="Select a country in the sidebar to see detailed SIRD-Model graphs for the selected country")
     
     # Sidebar selection
@@ -81,20 +102,21 @@ with tab2:
 
     st.header(f"SIRD Model for COVID-19 in {selected_country}")
 
+    # Render the six figures at the same time in worker processes
+    sird_images = render_sird_tab(selected_country)
+
     col1, col2 = st.columns([1, 1]) 
 
     #Call the function to generate the plot
     with col1:
-        fig = plot_sird_model(selected_country)
-        if fig:
-            st.pyplot(fig)
+        if sird_images["sird_model"]:
+            st.image(sird_images["sird_model"])
         else:
             st.warning(f"No data available for {selected_country}.")
 
     with col2:
-        fig_smoothed_sird = plot_smooth_sird(selected_country)
-        if fig_smoothed_sird:
-            st.pyplot(fig_smoothed_sird)
+        if sird_images["smooth_sird"]:
+            st.image(sird_images["smooth_sird"])
         else:
             st.warning(f"No data available for {selected_country}.")
 
@@ -103,25 +125,19 @@ with tab2:
     # Create two columns for side-by-side layout
     col3, col4 = st.columns([1, 1]) 
 
-
-    # Estimate parameters and fetch data
-    r0_data = estimate_parameters(selected_country)
-
     # Display R0 Trajectory in the first column
     with col3:
         st.subheader(rf"Reproduction Rate ($R_0$) Over Time")
-        fig_r0 = plot_R0_trajectory(r0_data, selected_country)
-        if fig_r0:
-            st.pyplot(fig_r0)
+        if sird_images["R0"]:
+            st.image(sird_images["R0"])
         else:
             st.error(rf"No ($R_0$) data available for {selected_country}.")
 
     # Display Death Rate Trajectory in the second column
     with col4:
         st.subheader(rf"Death Rate ($\mu$) Over Time")
-        fig_death = plot_death_rate(r0_data, selected_country)
-        if fig_death:
-            st.pyplot(fig_death)
+        if sird_images["death_rate"]:
+            st.image(sird_images["death_rate"])
         else:
             st.error(rf"No death rate ($\mu$) data available for {selected_country}.")
 
@@ -130,22 +146,20 @@ with tab2:
     # Display Alpha Trajectory in the third column
     with col5:
         st.subheader(rf"Alpha ($\alpha$) Over Time")
-        fig_alpha = plot_alpha(r0_data, selected_country)
-        if fig_alpha:
-            st.pyplot(fig_alpha)
+        if sird_images["alpha"]:
+            st.image(sird_images["alpha"])
         else:
             st.error(rf"No alpha ($\alpha$) data available for {selected_country}.")
     
     # Display Beta Trajectory in the fourth column
     with col6:
         st.subheader(rf"Beta ($\beta$) Over Time")
-        fig_beta = plot_beta(r0_data, selected_country)
-        if fig_beta:
-            st.pyplot(fig_beta)
+        if sird_images["beta"]:
+            st.image(sird_images["beta"])
         else:
             st.error(rf"No ($\beta$) data available for {selected_country}.")
 
-with tab3:
+with tab3, covid_trace.span("tab", "USA Statistics"):
     st.title("USA Statistics", help="Hover over the maps to see detailed data")
     st.plotly_chart(plot_usa_choropleth(), use_container_width=True) 
 
@@ -175,3 +189,23 @@ with tab3:
         top_x_deaths = top_x_deaths.rename(columns={"Admin2": "County", "Total": "Deaths"})
         st.dataframe(top_x_deaths, use_container_width=True, hide_index=True)
 
+    st.divider()
+
+    st.subheader("Cases Over Time", help="Select a state and a county to see their cases and deaths over time")
+    col5, col6 = st.columns([1, 1])
+    with col5:
+        selected_state = st.selectbox("State", ["All states"] + get_usa_states())
+    with col6:
+        counties = get_usa_counties(selected_state) if selected_state != "All states" else []
+        selected_county = st.selectbox("County", ["All counties"] + counties, disabled=not counties)
+
+    state = None if selected_state == "All states" else selected_state
+    county = None if selected_county == "All counties" else selected_county
+    st.plotly_chart(plot_usa_time_series(state, county), use_container_width=True)
+
+# Timings of this rerun, with downloads for offline analysis
+if trace is not None:
+    with st.sidebar.expander(f"Timings of this rerun ({trace.elapsed() * 1000:.0f} ms)"):
+        st.dataframe(trace.summary(), use_container_width=True, hide_index=True)
+        st.download_button("Download JSON", trace.to_json(), file_name="trace.json", mime="application/json")
+        st.download_button("Download Chrome trace", trace.to_chrome_trace(), file_name="trace.chrome.json", mime="application/json")